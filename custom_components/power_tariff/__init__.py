@@ -1,34 +1,127 @@
 """Support for power tariff."""
-import itertools
+import asyncio
+import json
 import logging
 import time
+from datetime import timedelta
 from operator import attrgetter
 
 import homeassistant.helpers.config_validation as cv
 import homeassistant.util.dt as dt_util
 import voluptuous as vol
-from homeassistant.const import SERVICE_TURN_OFF
+from homeassistant.const import (EVENT_HOMEASSISTANT_STOP, SERVICE_RELOAD,
+                                 SERVICE_TURN_OFF, SERVICE_TURN_ON)
+from homeassistant.core import callback
 from homeassistant.helpers import discovery
-from homeassistant.helpers.event import async_track_state_change
+from homeassistant.helpers.event import (async_track_point_in_utc_time,
+                                         async_track_state_change)
+from homeassistant.helpers.storage import Store
 from homeassistant.helpers.typing import ConfigType, HomeAssistantType
 
-from .const import DOMAIN
+from .audit import (DEFAULT_AUDIT_SIZE, DEFAULT_BACKUPS, DEFAULT_MAX_BYTES,
+                    AuditLog, DecisionRecord)
+from .coalesce import (DEFAULT_MAX_STALENESS, DEFAULT_MIN_INTERVAL,
+                       UpdateCoalescer)
+from .const import (DECISIONS_FILE, DEFAULT_VOLTAGE, DOMAIN,
+                    LIMIT_MODE_ENERGY, LIMIT_MODE_FORECAST, LIMIT_MODE_POWER,
+                    LIMIT_MODES, PRICE_ATTRS, SAVE_DELAY,
+                    SERVICE_DUMP_DECISIONS, STORAGE_KEY, STORAGE_VERSION)
+from .decision import DeviceSnapshot, Snapshot, decide, should_reduce_power
+from .dispatch import DEFAULT_MAX_CONCURRENT_CALLS, ServiceDispatcher
+from .energy import EnergyWindow
 from .exceptions import NoValidTariff
-from .schemas import DEVICE_SCHEMA, TARIFF_SCHEMA
+from .forecast import (DEFAULT_LEVEL_SMOOTHING, DEFAULT_TREND_HORIZON,
+                       DEFAULT_TREND_SMOOTHING, LoadForecaster)
+from .groups import GROUP_SCHEMA, DeviceGroup, DeviceGroups
+from .hysteresis import DeviceState
+from .meter import StateMeter
+from .metrics import Metrics
+from .restore import ShedDevices
+from .schedule import TariffSchedule, start_of_local_day
+from .schemas import DEVICE_SCHEMA, TARIFF_SCHEMA, cache_validation
+from .selection import STRATEGIES, STRATEGY_GREEDY, greedy
+from .table import DeviceTable
+from .throttle import Throttler
+from .tariff import Tariff  # noqa: F401
+from .validators import unique_names
 
 _LOGGER = logging.getLogger(__name__)
 
 
+CONTROLLER_SCHEMA = vol.Schema(
+    {
+        # Only needed when there is more then one controller, see unique_names.
+        vol.Optional("name"): cv.string,
+        vol.Required("monitor_entity"): cv.entity_id,
+        vol.Optional("tariffs"): vol.All(
+            cv.ensure_list, [lambda value: TARIFF_SCHEMA(value)]
+        ),
+        vol.Optional("devices"): vol.All(cv.ensure_list, [DEVICE_SCHEMA]),
+        vol.Optional("groups"): vol.All(cv.ensure_list, [GROUP_SCHEMA]),
+        vol.Optional("strategy", default=STRATEGY_GREEDY): vol.In(list(STRATEGIES)),
+        vol.Optional("strategy_time_budget", default=0.05): vol.Coerce(float),
+        vol.Optional("limit_mode", default=LIMIT_MODE_POWER): vol.In(LIMIT_MODES),
+        vol.Optional(
+            "forecast_level_smoothing", default=DEFAULT_LEVEL_SMOOTHING
+        ): vol.All(vol.Coerce(float), vol.Range(min=1)),
+        vol.Optional(
+            "forecast_trend_smoothing", default=DEFAULT_TREND_SMOOTHING
+        ): vol.All(vol.Coerce(float), vol.Range(min=1)),
+        vol.Optional(
+            "forecast_trend_horizon", default=DEFAULT_TREND_HORIZON
+        ): vol.All(vol.Coerce(float), vol.Range(min=0)),
+        vol.Optional("min_update_interval", default=DEFAULT_MIN_INTERVAL): vol.All(
+            vol.Coerce(float), vol.Range(min=0)
+        ),
+        vol.Optional("max_update_staleness", default=DEFAULT_MAX_STALENESS): vol.All(
+            vol.Coerce(float), vol.Range(min=0)
+        ),
+        vol.Optional("min_off_time", default=0.0): vol.All(
+            vol.Coerce(float), vol.Range(min=0)
+        ),
+        vol.Optional("min_on_time", default=0.0): vol.All(
+            vol.Coerce(float), vol.Range(min=0)
+        ),
+        vol.Optional("restore_margin", default=0.0): vol.All(
+            vol.Coerce(float), vol.Range(min=0)
+        ),
+        vol.Optional(
+            "max_concurrent_calls", default=DEFAULT_MAX_CONCURRENT_CALLS
+        ): vol.All(vol.Coerce(int), vol.Range(min=1)),
+        # Phase name to the entity with the amps on that phase.
+        vol.Inclusive("phases", "phases"): {cv.string: cv.entity_id},
+        vol.Inclusive("fuse_amps", "phases"): vol.All(
+            vol.Coerce(float), vol.Range(min=0)
+        ),
+        vol.Optional("voltage", default=DEFAULT_VOLTAGE): vol.All(
+            vol.Coerce(float), vol.Range(min=1)
+        ),
+        # Sensor with the hourly spot prices in the today and tomorrow attributes.
+        vol.Optional("price_entity"): cv.entity_id,
+        vol.Optional("planner_base_load", default=0.0): vol.All(
+            vol.Coerce(float), vol.Range(min=0)
+        ),
+        # Decisions kept in memory.
+        vol.Optional("audit_size", default=DEFAULT_AUDIT_SIZE): vol.All(
+            vol.Coerce(int), vol.Range(min=1)
+        ),
+        # Also write the decisions to this file, as json lines.
+        vol.Optional("audit_file"): cv.string,
+        vol.Optional("audit_file_max_bytes", default=DEFAULT_MAX_BYTES): vol.All(
+            vol.Coerce(int), vol.Range(min=0)
+        ),
+        vol.Optional("audit_file_backups", default=DEFAULT_BACKUPS): vol.All(
+            vol.Coerce(int), vol.Range(min=0)
+        ),
+    }
+)
+
 CONFIG_SCHEMA = vol.Schema(
     {
-        DOMAIN: vol.Schema(
-            {
-                vol.Required("monitor_entity"): cv.entity_id,
-                vol.Optional("tariffs"): vol.All(
-                    cv.ensure_list, [lambda value: TARIFF_SCHEMA(value)]
-                ),
-                vol.Optional("devices"): vol.All(cv.ensure_list, [DEVICE_SCHEMA]),
-            }
+        DOMAIN: cache_validation(
+            vol.All(
+                cv.ensure_list, vol.Length(min=1), [CONTROLLER_SCHEMA], unique_names
+            )
         )
     },
     extra=vol.ALLOW_EXTRA,
@@ -39,259 +132,884 @@ async def async_setup(hass: HomeAssistantType, config: ConfigType) -> bool:
     """Set up using yaml config file."""
     _LOGGER.info("Setup switch method!")
 
-    config = config[DOMAIN]
-    pc = PowerController(hass, config)
-    devs = []
-    tariffs = []
-    for device in config.get("devices"):
-        dev = (hass, device)
-        devs.append(dev)
+    configs = config[DOMAIN]
+    # Everything that can be shared between the controllers is.
+    dispatcher = ServiceDispatcher(
+        hass, max(conf.get("max_concurrent_calls") for conf in configs)
+    )
+    controllers = []
+    by_monitor_entity = {}
+    by_price_entity = {}
+
+    for index, conf in enumerate(configs):
+        pc = PowerController(hass, conf, dispatcher)
+        pc.add_tariff(list(conf.get("tariffs") or []))
+        pc.async_track_tariff()
+        controllers.append(pc)
+        by_monitor_entity.setdefault(conf.get("monitor_entity"), []).append(pc)
+        for entity_id in (conf.get("phases") or {}).values():
+            by_monitor_entity.setdefault(entity_id, []).append(pc)
+        if conf.get("price_entity"):
+            by_price_entity.setdefault(conf["price_entity"], []).append(pc)
+
+        discovery_info = {"controller": index, "devices": conf.get("devices")}
+        for platform in ("switch", "sensor"):
+            hass.async_create_task(
+                discovery.async_load_platform(
+                    hass, platform, DOMAIN, discovery_info, config
+                )
+            )
 
-    for tariff in config.get("tariffs"):
-        tar = Tariff(tariff)
-        tariffs.append(tar)
+    hass.data[DOMAIN] = controllers
 
-    async def cb(*args, **kwargs):
+    # Dont hold up the startup, updates are skipped until its loaded.
+    for pc in controllers:
+        hass.async_create_task(pc.async_load())
+
+    @callback
+    def cb(entity_id, old_state, new_state):
         # We don't really care about the cb, it just kick off everthing.
-        await pc.update()
+        for pc in by_monitor_entity.get(entity_id, ()):
+            pc.coalescer.async_request()
+        for pc in by_price_entity.get(entity_id, ()):
+            pc.async_update_prices()
 
-    pc.add_tariff(tariffs)
-    hass.data[DOMAIN] = pc
+    async_track_state_change(
+        hass, entity_ids=list(by_monitor_entity) + list(by_price_entity), action=cb
+    )
 
-    async_track_state_change(hass, entity_ids=config.get("monitor_entity"), action=cb)
+    # Not needed to simulate or tune, so only imported here.
+    from .views import (  # pylint: disable=import-outside-toplevel
+        DecisionsView,
+        MetricsView,
+    )
 
-    hass.async_create_task(
-        discovery.async_load_platform(
-            hass, "switch", DOMAIN, config.get("devices"), config
+    hass.http.register_view(MetricsView)
+    hass.http.register_view(DecisionsView)
+
+    async def async_reload(service):
+        """Reload the tariffs, devices and groups from configuration.yaml."""
+        from homeassistant import (  # pylint: disable=import-outside-toplevel
+            config as conf_util,
         )
-    )
 
-    return True
+        conf = await conf_util.async_hass_config_yaml(hass)
+        try:
+            configs = CONFIG_SCHEMA(conf)[DOMAIN]
+        except vol.Invalid as err:
+            _LOGGER.error("Invalid config, not reloading: %s", err)
+            return
 
+        if len(configs) != len(controllers):
+            _LOGGER.error("Adding or removing a controller needs a restart")
+            return
 
-class Tariff:
-    def __init__(self, settings):
-        self.name = settings.get("name")
-        self.enabled = settings.get("enabled")
-        self.priority = settings.get("priority")
-        self.limit_kwh = settings.get("limit_kwh")
-        self.over_limit_acceptance = settings.get("over_limit_acceptance")
-        self.over_limit_acceptance_seconds = settings.get(
-            "over_limit_acceptance_seconds"
-        )
-        self.restrictions = settings.get("restrictions", {})
+        for pc, settings in zip(controllers, configs):
+            pc.async_reload(settings)
 
-    def valid(self):
-        """validate if the tariff is valid (active)"""
-        now = dt_util.now()
+    hass.services.async_register(DOMAIN, SERVICE_RELOAD, async_reload)
 
-        if not len(self.restrictions):
-            _LOGGER.debug("No restrictions are added, as result its always valid..")
-            return True
-        else:
-            # Check for valid date range
-            if (
-                self.restrictions["date"]["start"] < now.date()
-                and now.date() < self.restrictions["date"]["end"]
-            ):
-                if now.strftime("%a").lower() in self.restrictions["weekday"]:
-                    if (
-                        self.restrictions["time"]["start"] < now.time()
-                        and now.time() < self.restrictions["time"]["end"]
-                    ):
-                        return True
-                    else:
-                        _LOGGER.debug(
-                            "%s  is not in valid time range start %s end %s",
-                            now.time(),
-                            self.restrictions["time"]["start"],
-                            self.restrictions["time"]["end"],
-                        )
+    async def async_dump_decisions(service):
+        """Write the decisions we have in memory to a json file in the config dir."""
+        decisions = _decisions(controllers)
+        for pc in controllers:
+            pc.async_flush_audit()
+        path = hass.config.path(DECISIONS_FILE)
+        await hass.async_add_executor_job(_write_json, path, decisions)
+        _LOGGER.info("Wrote the last decisions to %s", path)
 
-                else:
-                    _LOGGER.debug(
-                        "today %s is not in %s",
-                        "".join(self.restrictions["weekday"]),
-                        now.strftime("%a"),
-                    )
+    hass.services.async_register(DOMAIN, SERVICE_DUMP_DECISIONS, async_dump_decisions)
 
-            else:
-                _LOGGER.debug(
-                    "%s is not in valid date range start: %s end %s",
-                    now.date(),
-                    self.restrictions["date"]["start"],
-                    self.restrictions["date"]["end"],
-                )
+    async def async_stop(event):
+        """Write the decisions that arent in the audit files yet."""
+        jobs = [job for job in (pc.async_flush_audit() for pc in controllers) if job]
+        if jobs:
+            await asyncio.wait(jobs)
 
-        return False
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, async_stop)
 
-    @property
-    def tariff_limit(self):
-        """ """
-        return self.limit_kwh * (1 + self.over_limit_acceptance)
+    return True
+
+
+def _decisions(controllers):
+    return {pc.name or DOMAIN: pc.audit.as_list() for pc in controllers}
+
+
+def _write_json(path, data):
+    with open(path, "w") as fh:
+        json.dump(data, fh, indent=2)
 
 
 class PowerController:
-    def __init__(self, hass, settings):
+    def __init__(self, hass, settings, dispatcher=None, meter=None):
         _LOGGER.debug("%r", settings)
         self.hass = hass
         self.settings = settings
+        self.name = settings.get("name")
         self._current_tariff = None
         self.first_over_limit = None
         self.devices = []
         self.tariffs = []
-        self.ready = False
+        self.select_devices = STRATEGIES[settings.get("strategy", STRATEGY_GREEDY)]
+        self.select_time_budget = settings.get("strategy_time_budget", 0.05)
+        self.limit_mode = settings.get("limit_mode", LIMIT_MODE_POWER)
+        self.min_off_time = settings.get("min_off_time", 0.0)
+        self.min_on_time = settings.get("min_on_time", 0.0)
+        self.restore_margin = settings.get("restore_margin", 0.0)
+        self.device_states = {}
+        self.groups = DeviceGroups(settings.get("groups") or [])
+        self.table = DeviceTable()
+        # The devices with a setpoint.
+        self.throttled = []
+        self.throttler = Throttler()
+        self.shed = ShedDevices()
+        self._store = None
+        self._save_pending = False
+        self._restored = {}
+        self.energy = EnergyWindow()
+        self.forecaster = LoadForecaster(
+            settings.get("forecast_level_smoothing", DEFAULT_LEVEL_SMOOTHING),
+            settings.get("forecast_trend_smoothing", DEFAULT_TREND_SMOOTHING),
+            settings.get("forecast_trend_horizon", DEFAULT_TREND_HORIZON),
+        )
+        self.metrics = Metrics()
+        self.coalescer = UpdateCoalescer(
+            hass,
+            self.update,
+            settings.get("min_update_interval", DEFAULT_MIN_INTERVAL),
+            settings.get("max_update_staleness", DEFAULT_MAX_STALENESS),
+            self.metrics,
+        )
+        audit_file = settings.get("audit_file")
+        if audit_file is not None:
+            # Relative to the config dir, absolute paths are kept.
+            audit_file = hass.config.path(audit_file)
+        self.audit = AuditLog(
+            settings.get("audit_size", DEFAULT_AUDIT_SIZE),
+            audit_file,
+            settings.get("audit_file_max_bytes", DEFAULT_MAX_BYTES),
+            settings.get("audit_file_backups", DEFAULT_BACKUPS),
+        )
+        if dispatcher is None:
+            dispatcher = ServiceDispatcher(
+                hass,
+                settings.get("max_concurrent_calls", DEFAULT_MAX_CONCURRENT_CALLS),
+            )
+        self.dispatcher = dispatcher
+        self.schedule = TariffSchedule(self.tariffs)
+        self.phases = None
+        if settings.get("phases"):
+            from .phases import (  # pylint: disable=import-outside-toplevel
+                PhaseMeter,
+            )
 
-        # Remove me later
+            self.phases = PhaseMeter(
+                hass,
+                settings["phases"],
+                settings["fuse_amps"],
+                settings.get("voltage", DEFAULT_VOLTAGE),
+            )
+        # Device to the positions of its phases in self.phases.
+        self.phase_index = {}
+        self.planner = None
+        if settings.get("price_entity"):
+            from .planner import (  # pylint: disable=import-outside-toplevel
+                PricePlanner,
+            )
 
-        t = [2000] * 6 + [3000] * 6 + [2500] * 6 + [1000] * 6
-        self.t = itertools.cycle(t)
-        # remove me later.
+            self.planner = PricePlanner(settings.get("planner_base_load", 0.0))
+        self._unsub_plan_timer = None
+        self._unsub_tariff_timer = None
+        # Set by the switch platform, adds, changes and removes devices to
+        # match a list of DeviceSpec.
+        self.async_update_devices = None
+        self.ready = False
+        if meter is None:
+            meter = StateMeter(hass, settings.get("monitor_entity"))
+        self.meter = meter
 
     def add_device(self, device):
         if isinstance(device, list):
             self.devices.extend(device)
         else:
             self.devices.append(device)
+        for dev in self.devices:
+            if dev not in self.device_states:
+                self.device_states[dev] = DeviceState()
+                self._restore_device(dev)
+            if self.phases is not None and dev not in self.phase_index:
+                self.phase_index[dev] = self.phases.index(dev.phases)
+        # Keep them sorted here so the update doesnt have to.
+        self.devices.sort(key=attrgetter("priority"))
+        self.table.rebuild(self.devices)
+        self.groups.build(self.devices)
+        self.throttled = [device for device in self.devices if device.throttle]
+        if self.ready:
+            self.async_update_prices()
+
+    def remove_device(self, device):
+        self.devices.remove(device)
+        self.table.rebuild(self.devices)
+        self.groups.build(self.devices)
+        self.throttled = [dev for dev in self.devices if dev.throttle]
+        self.throttler.setpoints.pop(device, None)
+        self.device_states.pop(device, None)
+        self.phase_index.pop(device, None)
+        if device in self.shed:
+            self.shed.remove(device)
+
+    def device_changed(self, device):
+        """Call after the config of device has changed."""
+        self.phase_index.pop(device, None)
+        if device in self.shed:
+            power_usage = self.shed.power_usage[device]
+            self.shed.remove(device)
+            self.shed.add(device, power_usage)
+        self.add_device([])
+
+    @callback
+    def async_reload(self, settings):
+        """Use the tariffs, devices and groups from settings.
+
+        Everything else needs a restart.
+        """
+        _LOGGER.info("Reloading tariffs and devices")
+        self.tariffs[:] = settings.get("tariffs") or []
+        self.schedule.invalidate()
+        self.async_track_tariff()
+        self.groups = DeviceGroups(settings.get("groups") or [])
+        self.groups.build(self.devices)
+        if self.async_update_devices is not None:
+            self.async_update_devices(settings.get("devices") or [])
+        self.async_update_prices()
+        self.coalescer.async_request(sample=False)
 
     def add_tariff(self, tariff):
         if isinstance(tariff, list):
             self.tariffs.extend(tariff)
         else:
             self.tariffs.append(tariff)
+        self.schedule.invalidate()
 
     @property
     def current_tariff(self):
         return self._current_tariff
 
-    def check_tariff(self):
+    def check_tariff(self, timestamp=None):
         """Check if we have a valid tariff we should use, sets the first valid tariff as the current"""
-        for tariff in self.tariffs:
-            if tariff.enabled and tariff.valid():
-                _LOGGER.debug("Selected %s as current tariff", tariff.name)
-                self._current_tariff = tariff
-                break
-        else:
+        if timestamp is None:
+            timestamp = time.time()
+        started = time.perf_counter()
+        tariff = self.schedule.lookup(timestamp)
+        self.metrics.tariff_lookup.observe(time.perf_counter() - started)
+        if tariff is not self._current_tariff and tariff is not None:
+            _LOGGER.debug("Selected %s as current tariff", tariff.name)
+        self._current_tariff = tariff
+        if tariff is None:
             raise NoValidTariff
 
-    @property
-    def current_power_usage_org(self):
-        """There must be a better way to get it."""
-        state = self.hass.states.get(self.settings.get("monitor_entity"))
+    @callback
+    def async_track_tariff(self):
+        """Set the current tariff and arm a timer for the next restriction boundary.
+
+        This is the only place the tariff changes, so update() never has to
+        evaluate the tariffs itself.
+        """
+        if self._unsub_tariff_timer is not None:
+            self._unsub_tariff_timer()
+            self._unsub_tariff_timer = None
+
+        previous = self._current_tariff
         try:
-            return int(state.state)
-        except ValueError:
-            # unknown state comes to mind.
-            return 0
+            self.check_tariff()
+        except NoValidTariff:
+            _LOGGER.debug("No valid tariff until %s", self.schedule.next_boundary)
+
+        if self._current_tariff is not previous:
+            # The grace period belongs to the old limit.
+            self.first_over_limit = None
+
+        self._unsub_tariff_timer = async_track_point_in_utc_time(
+            self.hass,
+            self._tariff_boundary,
+            dt_util.utc_from_timestamp(self.schedule.next_boundary),
+        )
+        return self._current_tariff is not previous
+
+    @callback
+    def _tariff_boundary(self, now):
+        self._unsub_tariff_timer = None
+        if self.async_track_tariff():
+            _LOGGER.debug("Tariff boundary passed, rebalancing")
+            self.coalescer.async_request(sample=False)
 
     @property
-    def current_power_usage(self): # FAKE
-        """Just faked, just tired of turning on and off the stove.."""
-        return int(next(self.t))
-
-    async def pick_minimal_power_reduction(self):
-        """Turns off devices so we dont exceed the tariff limits."""
-        _LOGGER.debug("Checking what devices we can turn off")
-        power_reduced_kwh = 0
-        devs = []
-
-        # current_power_usage = self.current_power_usage
-        current_power_usage = self.current_power_usage
-
-        for device in sorted(self.devices, key=attrgetter("priority")):
-            if device.is_on is False:
-                _LOGGER.info("Device %r has been manually disabled", device)
-                continue
+    def current_power_usage(self):
+        return self.meter()
+
+    def _usage(self, power_usage, relief=0.0):
+        """usage, extra_factor and excess for the limit mode.
+
+        relief is the watts we have just turned down, but that the meter
+        doesnt show yet.
+        """
+        limit = self.current_tariff.tariff_limit
+        if self.limit_mode == LIMIT_MODE_ENERGY:
+            usage = self.energy.projected(-relief)
+            extra_factor = self.energy.remaining / 3600
+            excess = self.energy.watts_to_shed(limit, -relief)
+        elif self.limit_mode == LIMIT_MODE_FORECAST:
+            # Like energy, but with the forecast for the rest of the hour.
+            # What we have to shed is spread over the time left, so early
+            # in the hour we only turn off a little.
+            remaining = self.energy.remaining
+            usage = self.energy.energy + self.forecaster.energy(remaining)
+            usage -= relief * remaining / 3600
+            extra_factor = remaining / 3600
+            excess = (usage - limit) * 3600 / max(remaining, self.energy.slot_seconds)
+        else:
+            usage = power_usage - relief
+            extra_factor = 1.0
+            excess = usage - limit
+        return usage, extra_factor, excess
+
+    def take_snapshot(self, timestamp, power_usage, relief=0.0):
+        """Read everything the decision needs, once."""
+        limit = self.current_tariff.tariff_limit
+        usage, extra_factor, excess = self._usage(power_usage, relief)
+
+        phases = self.phases
+        phase_excess = ()
+        if phases is not None:
+            phase_excess = phases.excess(phases.read())
+
+        snapshot = Snapshot(
+            timestamp,
+            power_usage,
+            self.current_tariff,
+            limit,
+            limit - self.restore_margin,
+            usage,
+            extra_factor,
+            excess,
+            self.first_over_limit,
+            phase_excess,
+            (),
+        )
 
-            power_usage_state = device.get_power_usage()
-            power_reduced_kwh += power_usage_state
-            current_power_usage -= power_usage_state
-            devs.append(device)
-
-            if current_power_usage <= self.current_tariff.tariff_limit:
-                _LOGGER.info("Reached the limit..")
-                break
-
-        if devs:
-            for dev in devs:
-                await dev.proxy_turn_off()
-
-    async def should_reduce_power(self):
-        if self.current_power_usage > self.current_tariff.tariff_limit:
-            # if self.current_power_usage > self.current_tariff.tariff_limit:
-            if self.first_over_limit is None:
-                self.first_over_limit = time.time()
-
-            if self.current_tariff.over_limit_acceptance_seconds > 0:
-                if (
-                    time.time() - self.first_over_limit
-                    > self.current_tariff.over_limit_acceptance_seconds
-                ):
-                    _LOGGER.debug(
-                        "Been over limit for more then over_limit_acceptance_seconds %s",
-                        self.current_tariff.over_limit_acceptance_seconds,
-                    )
-                    self.first_over_limit = None
-                    return True
+        # When we are not going to reduce power we only need the devices we
+        # can turn on again, which usually is none of them.
+        reduce_power, _ = should_reduce_power(snapshot)
+        devices = []
+        group_of = self.groups.group_of
+        if reduce_power:
+            # Only the devices we may turn off, read from the table. Greedy
+            # only takes from the front, so we can stop once they cover excess.
+            table = self.table
+            power = table.power
+            enabled = table.enabled
+            budget = None
+            if self.select_devices is greedy and excess > 0:
+                if not any(value > 0 for value in phase_excess):
+                    budget = excess
+            covered = 0.0
+            for row, device in enumerate(table.devices):
+                if not enabled[row]:
+                    continue
+                group = group_of.get(device)
+                if group is None:
+                    if not self._can_shed(device, timestamp):
+                        continue
+                    dev = self._device_snapshot(device, power[row], True, False, phases)
+                elif device is group.anchor:
+                    # A group goes where its highest priority device is.
+                    dev = self._sheddable_group_snapshot(group, timestamp, phases)
+                    if dev is None:
+                        continue
                 else:
-                    _LOGGER.info("We are over the limit, but we havnt been over enough")
-                    return False
-            else:
-                return True
+                    continue
+                devices.append(dev)
+                covered += dev.power_usage
+                if budget is not None and covered >= budget:
+                    break
         else:
-            _LOGGER.debug(
-                "current_power_usage: %s, limit %s",
-                self.current_power_usage,
-                self.current_tariff.tariff_limit,
+            seen = set()
+            for device in self.shed:
+                group = group_of.get(device)
+                if group is None:
+                    devices.append(self._shed_snapshot(device, timestamp, phases))
+                elif group not in seen:
+                    # The first one is the highest priority device we turned
+                    # off, the group is turned on again as a whole.
+                    seen.add(group)
+                    members = [
+                        self._shed_snapshot(member, timestamp, phases)
+                        for member in group.members
+                        if member in self.shed
+                    ]
+                    devices.append(self._group_snapshot(group, members))
+
+        return snapshot._replace(devices=tuple(devices))
+
+    def _can_shed(self, device, timestamp):
+        return self.device_states[device].can_shed(
+            timestamp, self.min_off_time, self.min_on_time
+        )
+
+    def _shed_snapshot(self, device, timestamp, phases):
+        state = self.device_states[device]
+        return self._device_snapshot(
+            device,
+            self.shed.power_usage[device],
+            state.can_shed(timestamp, self.min_off_time, self.min_on_time),
+            state.can_restore(timestamp, self.min_off_time, self.min_on_time),
+            phases,
+        )
+
+    def _sheddable_group_snapshot(self, group, timestamp, phases):
+        """Snapshot of group if we can turn off all of it, None otherwise."""
+        table = self.table
+        members = []
+        for member in group.members:
+            row = table.rows[member]
+            if not table.enabled[row] or not self._can_shed(member, timestamp):
+                return None
+            members.append(
+                self._device_snapshot(member, table.power[row], True, False, phases)
             )
-            return False
+        return self._group_snapshot(group, members)
+
+    def _group_snapshot(self, group, members):
+        """One DeviceSnapshot for all the devices of group."""
+        actions = {member.action for member in members}
+        action = actions.pop() if len(actions) == 1 else None
+        return DeviceSnapshot(
+            group,
+            group.name,
+            group.name,
+            group.priority,
+            sum(member.power_usage for member in members),
+            True,
+            action,
+            any(m.proxy_on for m in members) if action is not None else None,
+            all(m.proxy_off for m in members) if action == SERVICE_TURN_OFF else None,
+            all(member.can_shed for member in members),
+            all(member.can_restore for member in members),
+            tuple(map(sum, zip(*(member.phase_amps for member in members)))),
+            tuple(members),
+        )
 
-    async def check_if_we_can_turn_on_devices(self):
-        """Turn off any devices we can without exceeding the tariff"""
-        # to turn on we dont allow temp usage to exceed tariff.
-        _LOGGER.debug("Checking if we can turn on any devices")
-        for device in self.devices:
-            # Make sure we only turn on stuff that pc has turned off.
-            if device.action == SERVICE_TURN_OFF and device.is_proxy_device_off():
-                if (
-                    # Dunno how helpfull it is to check the device current usage as
-                    # if its turned off it should be very low.
-                    self.current_power_usage + device.get_power_usage()
-                    < self.current_tariff.tariff_limit
-                ):
-                    _LOGGER.debug(
-                        "Device %s has been turned off by power controller, tring to turn it on",
-                        device.turn_on_entity,
-                    )
-                    await device.proxy_turn_on()
+    def _device_snapshot(self, device, device_power, can_shed, can_restore, phases):
+        action = device.action
+        phase_amps = ()
+        if phases is not None:
+            phase_amps = phases.device_amps(self.phase_index[device], device_power)
+        return DeviceSnapshot(
+            device,
+            device.turn_on_entity,
+            device.turn_off_entity,
+            device.priority,
+            device_power,
+            device.is_on,
+            action,
+            device.is_proxy_device_on() if action is not None else None,
+            device.is_proxy_device_off() if action == SERVICE_TURN_OFF else None,
+            can_shed,
+            can_restore,
+            phase_amps,
+            (),
+        )
+
+    async def update(self, power_usage=None, timestamp=None):
+        """Main method that really handles most of the work."""
+        started = time.perf_counter()
+        try:
+            await self._update(power_usage, timestamp)
+        finally:
+            self.metrics.update_latency.observe(time.perf_counter() - started)
+
+    async def _update(self, power_usage, timestamp):
+        _LOGGER.debug("Running update")
+        if self.ready is False:
+            return
+
+        if timestamp is None:
+            timestamp = time.time()
+        if power_usage is None:
+            power_usage = self.current_power_usage
+
+        if self.limit_mode != LIMIT_MODE_POWER:
+            self.energy.add(timestamp, power_usage)
+        if self.limit_mode == LIMIT_MODE_FORECAST:
+            self.forecaster.add(timestamp, power_usage)
+
+        if self.current_tariff is None:
+            _LOGGER.debug("No valid tariff")
+            return
+
+        relief = 0.0
+        if self.throttled:
+            relief = await self._throttle(power_usage)
+        snapshot = self.take_snapshot(timestamp, power_usage, relief)
+        self.metrics.headroom = snapshot.limit - snapshot.usage
+        plan = decide(snapshot, self.select_devices, self.select_time_budget)
+        self.first_over_limit = plan.first_over_limit
+        done = ()
+        if plan.steps:
+            powers = {
+                member.device: member.power_usage
+                for dev in snapshot.devices
+                for member in dev.members or (dev,)
+            }
+            done = await self.async_execute(plan.steps)
+            for device in done:
+                if device.action == SERVICE_TURN_OFF:
+                    self.device_states[device].shed(timestamp)
+                    self.shed.add(device, powers[device])
                 else:
-                    _LOGGER.debug(
-                        "Cant turn on %s without exceeding tariff_limit",
-                        device.turn_on_entity,
+                    self.device_states[device].restore(timestamp)
+                    self.shed.remove(device)
+
+        # Most updates dont do anything, only keep the ones that did or that
+        # started the wait for over_limit_acceptance_seconds.
+        if (
+            plan.steps
+            or plan.reduce
+            or relief
+            or (plan.first_over_limit is not None and snapshot.first_over_limit is None)
+        ):
+            self._audit(snapshot, plan, relief, done)
+
+        self.async_schedule_save()
+
+    def _audit(self, snapshot, plan, relief, done):
+        done = set(done)
+        self.audit.record(
+            DecisionRecord(
+                snapshot.timestamp,
+                snapshot.tariff.name,
+                snapshot.power_usage,
+                snapshot.usage,
+                snapshot.limit,
+                snapshot.excess,
+                snapshot.phase_excess,
+                plan.first_over_limit,
+                plan.reduce,
+                relief,
+                tuple((entity_id, service) for _, service, entity_id in plan.steps),
+                tuple(
+                    entity_id
+                    for device, _, entity_id in plan.steps
+                    if device not in done
+                ),
+            )
+        )
+        if self.audit.batch_ready:
+            self.async_flush_audit()
+
+    @callback
+    def async_flush_audit(self):
+        """Write the decisions that arent in the audit file yet, in the executor.
+
+        Returns the executor job, or None if there was nothing to write.
+        """
+        if self.audit.path is None:
+            return None
+        pending = self.audit.take_pending()
+        if not pending:
+            return None
+        return self.hass.async_add_executor_job(self.audit.write, pending)
+
+    def _setpoint(self, device):
+        """The setpoint device has now, max if we dont know."""
+        value = self.throttler.setpoints.get(device)
+        if value is not None:
+            return value
+        spec = device.throttle
+        state = self.hass.states.get(spec.entity)
+        try:
+            return min(max(float(state.state), spec.min), spec.max)
+        except (AttributeError, TypeError, ValueError):
+            return spec.max
+
+    async def _throttle(self, power_usage):
+        """Move the setpoints to fit the headroom, returns the watts turned down."""
+        usage, extra_factor, _ = self._usage(power_usage)
+        extra_factor = max(extra_factor, self.energy.slot_seconds / 3600)
+        headroom = (self.current_tariff.tariff_limit - usage) / extra_factor
+        if headroom > 0:
+            # The margin is in the unit of the limit, Wh in the energy modes.
+            headroom -= self.restore_margin / extra_factor
+            # The devices we have turned off get to come back first.
+            headroom -= sum(self.shed.power_usage.values())
+            headroom = max(headroom, 0.0)
+
+        devices = [
+            device
+            for device in self.throttled
+            if device not in self.shed and device.is_on is not False
+        ]
+        changes = self.throttler.plan(devices, headroom, self._setpoint)
+        if not changes:
+            return 0.0
+
+        _LOGGER.debug("Moving setpoints %r", changes)
+        values = [
+            (device, device.throttle.entity, value) for device, value, _ in changes
+        ]
+        done = set(await self.dispatcher.async_set_values(values, self.metrics))
+        relief = 0.0
+        for device, value, watts in changes:
+            if device in done:
+                self.throttler.setpoints[device] = value
+                relief -= watts
+        return relief
+
+    async def async_execute(self, steps):
+        """Run steps one group stage at the time, returns the devices that worked.
+
+        When a device in a group fails the rest of the group in the later
+        stages is left alone.
+        """
+        group_of = self.groups.group_of
+        done = []
+        failed = set()
+        for stage in self.groups.stages(steps):
+            if failed:
+                stage = [step for step in stage if group_of.get(step[0]) not in failed]
+            worked = await self.dispatcher.async_execute(stage, self.metrics)
+            done.extend(worked)
+            if len(worked) != len(stage):
+                worked = set(worked)
+                failed.update(
+                    group_of[device]
+                    for device, _, _ in stage
+                    if device not in worked and device in group_of
+                )
+        return done
+
+    async def async_load(self):
+        """Load what we knew before the last restart."""
+        key = f"{STORAGE_KEY}.{self.name}" if self.name else STORAGE_KEY
+        self._store = Store(self.hass, STORAGE_VERSION, key)
+        data = await self._store.async_load()
+        if data:
+            _LOGGER.debug("Restoring state from before the restart")
+            if (
+                self._current_tariff is not None
+                and data.get("tariff") == self._current_tariff.name
+            ):
+                self.first_over_limit = data.get("first_over_limit")
+            if data.get("energy"):
+                self.energy.load(data["energy"])
+            self._restored = data.get("devices", {})
+            for device in self.devices:
+                self._restore_device(device)
+
+        self.ready = True
+        self.async_update_prices()
+
+    def _restore_device(self, device):
+        data = self._restored.pop(device.turn_on_entity, None)
+        if data is None:
+            return
+
+        action, state, power_usage = data
+        device.action = action
+        self.device_states[device].load(state)
+        if power_usage is not None:
+            self.shed.add(device, power_usage)
+
+    @callback
+    def async_schedule_save(self):
+        """Save the state soon, at most one write per SAVE_DELAY."""
+        if self._store is None or self._save_pending:
+            return
+        self._save_pending = True
+        self._store.async_delay_save(self._dump_state, SAVE_DELAY)
+
+    @callback
+    def _dump_state(self):
+        self._save_pending = False
+        devices = {}
+        for device in self.devices:
+            devices[device.turn_on_entity] = [
+                device.action,
+                self.device_states[device].dump(),
+                self.shed.power_usage.get(device),
+            ]
+
+        return {
+            "tariff": getattr(self._current_tariff, "name", None),
+            "first_over_limit": self.first_over_limit,
+            "energy": self.energy.dump() if self.energy.period_start else None,
+            "devices": devices,
+        }
+
+    def _deferrable(self):
+        """(device, watts, run_hours) for the devices the planner moves around.
+
+        A group is planned as one, for the most run_hours of its devices.
+        """
+        deferrable = []
+        seen = set()
+        group_of = self.groups.group_of
+        for device in reversed(self.devices):
+            if not device.run_hours:
+                continue
+            group = group_of.get(device)
+            if group is None:
+                deferrable.append(
+                    (device, float(device.assumed_usage), device.run_hours)
+                )
+            elif group not in seen:
+                seen.add(group)
+                deferrable.append(
+                    (
+                        group,
+                        sum(float(member.assumed_usage) for member in group.members),
+                        max(member.run_hours or 0 for member in group.members),
                     )
-            else:
-                _LOGGER.debug(
-                    "%s is off or wasnt turned off by pc.", device.turn_on_entity
                 )
+        return deferrable
+
+    def _hour_caps(self, day_start, hours):
+        """The Wh we may use in every hour, from the tariff limits."""
+        caps = []
+        for hour in range(hours):
+            tariff = self.schedule.lookup(day_start + hour * 3600 + 1800)
+            caps.append(float("inf") if tariff is None else tariff.limit_kwh)
+        return caps
+
+    @callback
+    def async_update_prices(self):
+        """Plan again for the days whose prices changed."""
+        if self.planner is None:
+            return
+        state = self.hass.states.get(self.settings.get("price_entity"))
+        if state is None:
+            return
+
+        devices = self._deferrable()
+        today = dt_util.now().date()
+        changed = False
+        for offset, attr in enumerate(PRICE_ATTRS):
+            prices = state.attributes.get(attr)
+            if not prices:
+                continue
+            day_start = start_of_local_day(today + timedelta(days=offset)).timestamp()
+            changed |= self.planner.update(
+                day_start, prices, devices, self._hour_caps(day_start, len(prices))
+            )
 
-    async def update(self, power_usage=None):
-        """Main method that really handles most of the work."""
-        _LOGGER.info("Running update")
-        # if self.ready is False:
-        #    return
-
-        self.check_tariff()
-
-        if self.current_tariff.valid():
-            reduce_power = await self.should_reduce_power()
-            _LOGGER.debug(
-                "Should we reduce power: %s, current usage: %s",
-                reduce_power,
-                self.current_power_usage,
+        if changed:
+            self.async_run_plan()
+
+    @callback
+    def async_run_plan(self, now=None):
+        """Carry out the plan for this hour and arm a timer for the next."""
+        if self._unsub_plan_timer is not None:
+            self._unsub_plan_timer()
+            self._unsub_plan_timer = None
+
+        timestamp = time.time()
+        self.planner.prune(timestamp)
+        self.hass.async_create_task(self._run_plan(timestamp))
+
+        next_hour = self.planner.next_hour(timestamp)
+        if next_hour is not None:
+            self._unsub_plan_timer = async_track_point_in_utc_time(
+                self.hass, self.async_run_plan, dt_util.utc_from_timestamp(next_hour)
             )
-            if reduce_power:
-                await self.pick_minimal_power_reduction()
+
+    def _plan_headroom(self):
+        """Watts the plan may turn on now without going over the restore limit."""
+        if self.current_tariff is None:
+            return float("inf")
+        usage, extra_factor, _ = self._usage(self.current_power_usage)
+        extra_factor = max(extra_factor, self.energy.slot_seconds / 3600)
+        restore_limit = self.current_tariff.tariff_limit - self.restore_margin
+        headroom = (restore_limit - usage) / extra_factor
+        # The devices we have turned off get to come back first.
+        return headroom - sum(self.shed.power_usage.values())
+
+    def _release(self, device, power_usage):
+        """Leave turning device on to the restore pass."""
+        self.device_states[device].release()
+        self.shed.add(device, power_usage)
+
+    async def _run_plan(self, timestamp):
+        if self.ready is False:
+            return
+
+        headroom = self._plan_headroom()
+        steps = []
+        for device, _, _ in self._deferrable():
+            if isinstance(device, DeviceGroup):
+                members = device.members
             else:
-                await self.check_if_we_can_turn_on_devices()
-        else:
-            _LOGGER.debug("No valid tariff")
+                members = (device,)
+            if any(member.is_on is False for member in members):
+                continue
+            states = [self.device_states[member] for member in members]
+            wanted = self.planner.wanted(device, timestamp)
+            if wanted is None:
+                # No plan for this hour, it is up to the limiter again.
+                for member, state in zip(members, states):
+                    if state.held:
+                        self._release(member, float(member.assumed_usage))
+                continue
+            if wanted:
+                # Restoring turns it on when there is room for it.
+                if any(member in self.shed for member in members):
+                    continue
+                off = [
+                    member for member in members if not member.is_proxy_device_on()
+                ]
+                if not off:
+                    for state in states:
+                        if state.held:
+                            state.reset()
+                    continue
+                power_usage = sum(float(member.assumed_usage) for member in off)
+                if power_usage <= headroom:
+                    headroom -= power_usage
+                    steps.extend(
+                        (member, SERVICE_TURN_ON, member.turn_on_entity)
+                        for member in off
+                    )
+                elif any(state.held for state in states):
+                    _LOGGER.debug("No room for %s yet", device.turn_on_entity)
+                    for member, state in zip(members, states):
+                        if state.held:
+                            self._release(member, float(member.assumed_usage))
+            else:
+                # Off by plan, so it shouldnt be shed or restored.
+                for member, state in zip(members, states):
+                    if member in self.shed:
+                        self.shed.remove(member)
+                    if member.is_proxy_device_off():
+                        state.hold(timestamp, called=False)
+                        continue
+                    steps.append((member, SERVICE_TURN_OFF, member.turn_off_entity))
+
+        # Turning off first makes room for what we turn on.
+        for service in (SERVICE_TURN_OFF, SERVICE_TURN_ON):
+            service_steps = [step for step in steps if step[1] == service]
+            if not service_steps:
+                continue
+            _LOGGER.debug("Running the plan %r", service_steps)
+            for device in await self.async_execute(service_steps):
+                if service == SERVICE_TURN_OFF:
+                    self.device_states[device].hold(timestamp)
+                else:
+                    self.device_states[device].restore(timestamp)
+        self.async_schedule_save()
+
+    def service_calls_last_hour(self, now=None):
+        """Service calls we made for the devices in the last whole hour."""
+        if now is None:
+            now = time.time()
+        return sum(
+            state.service_calls_last_hour(now) for state in self.device_states.values()
+        )
@@ -0,0 +1,125 @@
+"""Why the controller did what it did, kept in memory and optionally in a file.
+
+Records are plain tuples of what update() already has at hand. Turning
+them into something readable only happens when someone asks for them.
+"""
+import json
+import logging
+from collections import deque, namedtuple
+
+import homeassistant.util.dt as dt_util
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_AUDIT_SIZE = 500
+DEFAULT_MAX_BYTES = 1000000
+DEFAULT_BACKUPS = 3
+# Records written to the file at once.
+BATCH_SIZE = 50
+
+DecisionRecord = namedtuple(
+    "DecisionRecord",
+    [
+        "timestamp",
+        "tariff",
+        # Meter reading in watts.
+        "power_usage",
+        # Like in decision.Snapshot.
+        "usage",
+        "limit",
+        "excess",
+        "phase_excess",
+        "first_over_limit",
+        "reduce",
+        # Watts we turned down with the setpoints.
+        "relief",
+        # (entity_id, service) we called.
+        "steps",
+        # The entities where the call failed.
+        "failed",
+    ],
+)
+
+
+def reason(record):
+    if record.reduce:
+        if record.usage <= record.limit:
+            return "phase over the fuse"
+        return "over the limit"
+    if record.steps:
+        return "room to turn on again"
+    if record.first_over_limit is not None:
+        return "over the limit, waiting for over_limit_acceptance_seconds"
+    if record.relief:
+        return "setpoints moved"
+    return "under the limit"
+
+
+def as_dict(record):
+    """Something that can be shown to a human, or turned into json."""
+    data = record._asdict()
+    data["time"] = dt_util.utc_from_timestamp(record.timestamp).isoformat()
+    data["reason"] = reason(record)
+    data["steps"] = [list(step) for step in record.steps]
+    data["failed"] = list(record.failed)
+    data["phase_excess"] = list(record.phase_excess)
+    return data
+
+
+class AuditLog:
+    """The last size decisions, and the ones not written to path yet."""
+
+    def __init__(
+        self,
+        size=DEFAULT_AUDIT_SIZE,
+        path=None,
+        max_bytes=DEFAULT_MAX_BYTES,
+        backups=DEFAULT_BACKUPS,
+        batch_size=BATCH_SIZE,
+    ):
+        self.records = deque(maxlen=size)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.batch_size = batch_size
+        self._pending = []
+        self._logger = None
+
+    def record(self, record):
+        self.records.append(record)
+        if self.path is not None:
+            self._pending.append(record)
+
+    @property
+    def batch_ready(self):
+        return len(self._pending) >= self.batch_size
+
+    def take_pending(self):
+        """The records that arent written yet, they are forgotten here."""
+        pending = self._pending
+        self._pending = []
+        return pending
+
+    def write(self, records):
+        """Append records to the file as json lines, does blocking io."""
+        if self._logger is None:
+            # Only needed with audit_file.
+            from logging.handlers import (  # pylint: disable=import-outside-toplevel
+                RotatingFileHandler,
+            )
+
+            # Our own logger so it doesnt end up in home-assistant.log.
+            self._logger = logging.getLogger(f"{__name__}.{self.path}")
+            self._logger.propagate = False
+            self._logger.setLevel(logging.INFO)
+            handler = RotatingFileHandler(
+                self.path, maxBytes=self.max_bytes, backupCount=self.backups
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._logger.addHandler(handler)
+
+        for record in records:
+            self._logger.info(json.dumps(as_dict(record)))
+
+    def as_list(self):
+        return [as_dict(record) for record in self.records]
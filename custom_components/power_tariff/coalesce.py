@@ -0,0 +1,86 @@
+"""Single-flight scheduling of controller updates."""
+import asyncio
+import logging
+import time
+
+from homeassistant.core import callback
+
+from .metrics import Metrics
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_MIN_INTERVAL = 0.0
+DEFAULT_MAX_STALENESS = 5.0
+
+
+class UpdateCoalescer:
+    """Make sure only one update runs at a time.
+
+    Requests that arrive while an update is running or waiting are merged,
+    so the next run sees the latest sample. Runs are at least min_interval
+    seconds apart, but no request waits longer than max_staleness. The
+    samples received, coalesced and processed are counted in metrics, to
+    see if min_interval is right.
+    """
+
+    def __init__(
+        self,
+        hass,
+        action,
+        min_interval=DEFAULT_MIN_INTERVAL,
+        max_staleness=DEFAULT_MAX_STALENESS,
+        metrics=None,
+    ):
+        self.hass = hass
+        self.min_interval = min_interval
+        self.max_staleness = max_staleness
+        self._action = action
+        self._task = None
+        self._pending_since = None
+        self._last_run = None
+        if metrics is None:
+            metrics = Metrics()
+        self.metrics = metrics
+
+    @callback
+    def async_request(self, sample=True):
+        """Ask for an update, sample is False if it wasnt caused by the meter."""
+        if sample:
+            self.metrics.samples_received += 1
+
+        if self._pending_since is not None:
+            if sample:
+                self.metrics.samples_coalesced += 1
+        else:
+            self._pending_since = time.monotonic()
+
+        if self._task is None:
+            self._task = self.hass.async_create_task(self._run())
+
+    async def _run(self):
+        try:
+            while self._pending_since is not None:
+                now = time.monotonic()
+                wait = 0.0
+                if self._last_run is not None:
+                    wait = self._last_run + self.min_interval - now
+                wait = min(wait, self._pending_since + self.max_staleness - now)
+                if wait > 0:
+                    await asyncio.sleep(wait)
+
+                self._pending_since = None
+                self._last_run = time.monotonic()
+                self.metrics.samples_processed += 1
+                try:
+                    await self._action()
+                except Exception:  # pylint: disable=broad-except
+                    _LOGGER.exception("Update failed")
+        finally:
+            self._task = None
+
+        _LOGGER.debug(
+            "Samples received %s, coalesced %s, processed %s",
+            self.metrics.samples_received,
+            self.metrics.samples_coalesced,
+            self.metrics.samples_processed,
+        )
@@ -1,2 +1,23 @@
 DOMAIN = "power_tariff"
+DATA_ENTITY_INDEX = f"{DOMAIN}_entity_index"
 POWER_ATTRS = ["power_usage", "current_consumption"]
+
+LIMIT_MODE_POWER = "power"
+LIMIT_MODE_ENERGY = "energy"
+LIMIT_MODE_FORECAST = "forecast"
+LIMIT_MODES = [LIMIT_MODE_POWER, LIMIT_MODE_ENERGY, LIMIT_MODE_FORECAST]
+
+# Volts, for the phases when no voltage is set.
+DEFAULT_VOLTAGE = 230.0
+
+STORAGE_KEY = DOMAIN
+STORAGE_VERSION = 1
+# Seconds
+SAVE_DELAY = 30
+
+# Attributes on the price sensor with the hourly prices, from midnight.
+PRICE_ATTRS = ["today", "tomorrow"]
+
+SERVICE_DUMP_DECISIONS = "dump_decisions"
+# In the config dir.
+DECISIONS_FILE = f"{DOMAIN}_decisions.json"
@@ -0,0 +1,218 @@
+"""The decisions the power controller makes, as pure functions of a snapshot.
+
+PowerController.update() reads everything once into a Snapshot and hands
+it to decide(), which returns a Plan. Nothing in here reads the state
+machine or calls services, so a recorded snapshot can be replayed offline.
+"""
+import logging
+from collections import namedtuple
+
+from homeassistant.const import SERVICE_TURN_OFF, SERVICE_TURN_ON
+
+from .selection import by_phase
+
+_LOGGER = logging.getLogger(__name__)
+
+DeviceSnapshot = namedtuple(
+    "DeviceSnapshot",
+    [
+        "device",
+        "turn_on_entity",
+        "turn_off_entity",
+        "priority",
+        "power_usage",
+        "enabled",
+        "action",
+        # Only read when action says we need them, None otherwise.
+        "proxy_on",
+        "proxy_off",
+        # From the device's hysteresis.DeviceState.
+        "can_shed",
+        "can_restore",
+        # Amps on every phase, empty without phases.
+        "phase_amps",
+        # For a group the DeviceSnapshot of every device in it, in the
+        # order they are turned on. Empty for a single device.
+        "members",
+    ],
+)
+
+Snapshot = namedtuple(
+    "Snapshot",
+    [
+        "timestamp",
+        # Meter reading in watts.
+        "power_usage",
+        "tariff",
+        "limit",
+        # Turning devices on again must keep usage under this.
+        "restore_limit",
+        # What we compare with limit, the power usage right now or in energy
+        # mode the energy we expect to have used when the hour ends.
+        "usage",
+        # How much usage grows per extra watt we turn on.
+        "extra_factor",
+        # Watts we need to turn off to get under limit.
+        "excess",
+        "first_over_limit",
+        # Amps over the fuse on every phase, negative is headroom. Empty
+        # without phases.
+        "phase_excess",
+        # When reducing power every device, lowest priority first. Otherwise
+        # only the devices we have turned off, highest priority first, with
+        # the power usage from before we turned them off.
+        "devices",
+    ],
+)
+
+Plan = namedtuple("Plan", ["reduce", "steps", "first_over_limit"])
+
+_IS_ON = {"on": True, "off": False, "turn_off": False, "turn_on": True}
+
+
+def changed_manually(action, proxy_on):
+    """Check if the proxy device has changed since our last action."""
+    return action is not None and _IS_ON[action] is not proxy_on
+
+
+def plan_steps(dev, service):
+    """The steps to turn dev on or off, all the devices for a group.
+
+    Returns None if any of them has been changed manually.
+    """
+    members = dev.members or (dev,)
+    for member in members:
+        if changed_manually(member.action, member.proxy_on):
+            _LOGGER.info(
+                "Proxy device has changed status without power controller doing it (fx manually pressed the button, a automation or something), not doing anything."
+            )
+            return None
+
+    if service == SERVICE_TURN_OFF:
+        return [(m.device, service, m.turn_off_entity) for m in members]
+    return [(m.device, service, m.turn_on_entity) for m in members]
+
+
+def should_reduce_power(snapshot):
+    """Returns if we should reduce power and the new first_over_limit."""
+    tariff = snapshot.tariff
+    first_over_limit = snapshot.first_over_limit
+    if snapshot.usage > snapshot.limit or any(
+        excess > 0 for excess in snapshot.phase_excess
+    ):
+        if first_over_limit is None:
+            first_over_limit = snapshot.timestamp
+
+        if tariff.over_limit_acceptance_seconds > 0:
+            if (
+                snapshot.timestamp - first_over_limit
+                > tariff.over_limit_acceptance_seconds
+            ):
+                _LOGGER.debug(
+                    "Been over limit for more then over_limit_acceptance_seconds %s",
+                    tariff.over_limit_acceptance_seconds,
+                )
+                return True, None
+            else:
+                _LOGGER.debug("We are over the limit, but we havnt been over enough")
+                return False, first_over_limit
+        else:
+            return True, first_over_limit
+    else:
+        _LOGGER.debug("usage: %s, limit %s", snapshot.usage, snapshot.limit)
+        return False, first_over_limit
+
+
+def pick_minimal_power_reduction(snapshot, select_devices, time_budget):
+    """Pick the devices to turn off so we dont exceed the tariff limits."""
+    _LOGGER.debug("Checking what devices we can turn off")
+    candidates = []
+    for dev in snapshot.devices:
+        if dev.enabled is False:
+            _LOGGER.info("Device %r has been manually disabled", dev.device)
+            continue
+        if not dev.can_shed:
+            _LOGGER.debug("%s was turned on too recently", dev.turn_on_entity)
+            continue
+
+        candidates.append((dev, dev.power_usage))
+
+    devs = []
+    if snapshot.excess > 0:
+        devs = select_devices(candidates, snapshot.excess, time_budget)
+    if any(excess > 0 for excess in snapshot.phase_excess):
+        _LOGGER.debug("Phase over the fuse %s", snapshot.phase_excess)
+        devs += by_phase(candidates, snapshot.phase_excess, devs)
+
+    steps = []
+    for dev in devs:
+        dev_steps = plan_steps(dev, SERVICE_TURN_OFF)
+        if dev_steps is not None:
+            steps.extend(dev_steps)
+
+    return steps
+
+
+def check_if_we_can_turn_on_devices(snapshot):
+    """Pick the devices we can turn on without exceeding the tariff."""
+    # to turn on we dont allow temp usage to exceed tariff.
+    _LOGGER.debug("Checking if we can turn on any devices")
+    # All the devices are turned on at once, so count what we have
+    # already planned to turn on. We stop at the first device that doesnt
+    # fit so lower priority devices dont take the headroom.
+    planned_power = 0.0
+    planned_amps = snapshot.phase_excess
+    steps = []
+    for dev in snapshot.devices:
+        # Make sure we only turn on stuff that pc has turned off.
+        if dev.action == SERVICE_TURN_OFF and dev.proxy_off:
+            if not dev.can_restore:
+                _LOGGER.debug("%s was turned off too recently", dev.turn_on_entity)
+                continue
+            amps = tuple(
+                planned + value for planned, value in zip(planned_amps, dev.phase_amps)
+            )
+            if (
+                # Dunno how helpfull it is to check the device current usage as
+                # if its turned off it should be very low.
+                snapshot.usage
+                + (planned_power + dev.power_usage) * snapshot.extra_factor
+                < snapshot.restore_limit
+                and all(value < 0 for value in amps)
+            ):
+                dev_steps = plan_steps(dev, SERVICE_TURN_ON)
+                if dev_steps is None:
+                    continue
+                _LOGGER.debug(
+                    "Device %s has been turned off by power controller, tring to turn it on",
+                    dev.turn_on_entity,
+                )
+                planned_power += dev.power_usage
+                planned_amps = amps
+                steps.extend(dev_steps)
+            else:
+                _LOGGER.debug(
+                    "Cant turn on %s without exceeding tariff_limit",
+                    dev.turn_on_entity,
+                )
+                break
+        else:
+            _LOGGER.debug("%s is off or wasnt turned off by pc.", dev.turn_on_entity)
+
+    return steps
+
+
+def decide(snapshot, select_devices, time_budget):
+    """Work out what to do for snapshot."""
+    reduce_power, first_over_limit = should_reduce_power(snapshot)
+    _LOGGER.debug(
+        "Should we reduce power: %s, current usage: %s",
+        reduce_power,
+        snapshot.power_usage,
+    )
+    if reduce_power:
+        steps = pick_minimal_power_reduction(snapshot, select_devices, time_budget)
+    else:
+        steps = check_if_we_can_turn_on_devices(snapshot)
+
+    return Plan(reduce_power, steps, first_over_limit)
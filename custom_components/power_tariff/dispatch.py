@@ -0,0 +1,123 @@
+"""Run the service calls for a batch of devices."""
+import asyncio
+import logging
+import time
+
+from homeassistant.const import ATTR_ENTITY_ID
+from homeassistant.exceptions import ServiceNotFound
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONCURRENT_CALLS = 4
+# number and input_number both have it.
+SERVICE_SET_VALUE = "set_value"
+
+
+class ServiceDispatcher:
+    """Groups a plan into as few service calls as possible and runs them concurrently.
+
+    A plan is a list of (device, service, entity_id). Entities that share a
+    service and an entity domain go in the same call, and at most
+    max_concurrent calls are in flight at once.
+    """
+
+    def __init__(self, hass, max_concurrent=DEFAULT_MAX_CONCURRENT_CALLS):
+        self.hass = hass
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+
+    async def _call(self, domain, service, data, metrics):
+        async with self._semaphore:
+            _LOGGER.debug(
+                "tried to called with domain %s service %s %r", domain, service, data,
+            )
+            started = time.perf_counter()
+            try:
+                # Blocking, so we know if it worked and the semaphore limits
+                # the calls that are actually running.
+                return await self.hass.services.async_call(
+                    domain, service, data, blocking=True
+                )
+            finally:
+                if metrics is not None:
+                    metrics.service_calls += 1
+                    metrics.service_latency.observe(time.perf_counter() - started)
+
+    async def async_execute(self, plan, metrics=None):
+        """Run the plan, returns the devices whose call succeeded.
+
+        The calls are counted in metrics if given.
+        """
+        groups = {}
+        for device, service, entity_id in plan:
+            key = (service, entity_id.split(".")[0])
+            groups.setdefault(key, []).append((device, entity_id))
+
+        if not groups:
+            return []
+
+        results = await asyncio.gather(
+            *[
+                self._call(
+                    "homeassistant",
+                    service,
+                    {ATTR_ENTITY_ID: [entity_id for _, entity_id in members]},
+                    metrics,
+                )
+                for (service, _), members in groups.items()
+            ],
+            return_exceptions=True,
+        )
+
+        done = []
+        for ((service, _), members), result in zip(groups.items(), results):
+            if not self._succeeded(service, result, metrics):
+                continue
+
+            for device, _ in members:
+                device.action = service
+                done.append(device)
+
+        return done
+
+    async def async_set_values(self, values, metrics=None):
+        """Set the setpoints in values, a list of (device, entity_id, value).
+
+        Every entity is a call of its own, returns the devices that worked.
+        """
+        results = await asyncio.gather(
+            *[
+                self._call(
+                    entity_id.split(".")[0],
+                    SERVICE_SET_VALUE,
+                    {ATTR_ENTITY_ID: entity_id, "value": value},
+                    metrics,
+                )
+                for _, entity_id, value in values
+            ],
+            return_exceptions=True,
+        )
+        return [
+            device
+            for (device, _, _), result in zip(values, results)
+            if self._succeeded(SERVICE_SET_VALUE, result, metrics)
+        ]
+
+    @staticmethod
+    def _succeeded(service, result, metrics):
+        if isinstance(result, ServiceNotFound):
+            _LOGGER.info("Maybe Service wasnt ready yet")
+            if metrics is not None:
+                metrics.service_not_found += 1
+            return False
+        elif isinstance(result, Exception):
+            _LOGGER.error("Failed to call %s: %s", service, result)
+            if metrics is not None:
+                metrics.service_failures += 1
+            return False
+        elif result is False:
+            # Still running in hass, we cant tell if it will work.
+            _LOGGER.warning("%s didnt finish in time", service)
+            if metrics is not None:
+                metrics.service_failures += 1
+            return False
+        return True
@@ -0,0 +1,191 @@
+"""Energy accounting for tariffs that bill on the energy used per hour.
+
+Nothing in here depends on Home Assistant, timestamps are plain unix
+timestamps in seconds and power is in watts. Energy is in watt hours so it
+can be compared directly to the tariff limit.
+"""
+import logging
+from array import array
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_PERIOD = 3600
+DEFAULT_HISTORY = 600
+DEFAULT_SLOTS = 60
+
+
+class EnergyWindow:
+    """Integrates meter samples and projects the energy used this period.
+
+    Every sample costs O(1): the trapezoid since the last sample is added to
+    the energy used in the current period (aligned to whole periods, so whole
+    hours for the default) and spread over a ring of per-slot energy
+    covering the last history seconds, so at most slots additions. The
+    projection assumes the average power in the ring continues until the
+    period ends, so a short spike does not trigger shedding on its own.
+    """
+
+    def __init__(
+        self, period=DEFAULT_PERIOD, history=DEFAULT_HISTORY, slots=DEFAULT_SLOTS
+    ):
+        self.period = period
+        self.history = history
+        self.slot_seconds = history / slots
+        self._size = slots
+        self._slots = array("d", [0.0]) * slots
+        self._slot = 0
+        self._recent = 0.0
+        self._first_ts = None
+        self._last_ts = None
+        self._last_power = 0.0
+        self.period_start = None
+        self.energy = 0.0
+
+    @property
+    def period_end(self):
+        return self.period_start + self.period
+
+    def reset(self, timestamp=None, power=0.0):
+        """Forget everything, optionally starting over from a sample."""
+        for idx in range(self._size):
+            self._slots[idx] = 0.0
+        self._recent = 0.0
+        self.energy = 0.0
+        self._first_ts = timestamp
+        self._last_ts = timestamp
+        self._last_power = power
+        if timestamp is None:
+            self.period_start = None
+        else:
+            self.period_start = timestamp - timestamp % self.period
+            self._slot = int(timestamp // self.slot_seconds)
+
+    def _advance(self, slot):
+        """Move the ring on to slot, emptying the slots we pass."""
+        if slot - self._slot >= self._size:
+            for idx in range(self._size):
+                self._slots[idx] = 0.0
+            self._recent = 0.0
+            self._slot = slot
+        while self._slot < slot:
+            self._slot += 1
+            pos = self._slot % self._size
+            self._recent -= self._slots[pos]
+            self._slots[pos] = 0.0
+
+    def _add_to_ring(self, start, end, start_power, end_power):
+        """Spread the trapezoid from start to end over the slots it covers.
+
+        Putting it all in one slot would leave the ring short of energy for
+        the time it covers when samples are sparse.
+        """
+        if end <= start:
+            return
+        slope = (end_power - start_power) / (end - start)
+        # Only the last history seconds fit in the ring.
+        if end - start > self.history:
+            start_power += slope * (end - self.history - start)
+            start = end - self.history
+
+        while start < end:
+            slot = int(start // self.slot_seconds)
+            stop = min((slot + 1) * self.slot_seconds, end)
+            stop_power = start_power + slope * (stop - start)
+            wh = (start_power + stop_power) / 2 * (stop - start) / 3600
+            self._advance(slot)
+            self._slots[slot % self._size] += wh
+            self._recent += wh
+            start = stop
+            start_power = stop_power
+
+    def add(self, timestamp, power):
+        """Add a meter sample, power in watts."""
+        if self._last_ts is None or timestamp - self._last_ts > self.period:
+            # First sample or a gap we can't say anything useful about.
+            self.reset(timestamp, power)
+            return
+
+        if timestamp <= self._last_ts:
+            self._last_power = power
+            return
+
+        start = self._last_ts
+        start_power = self._last_power
+        while timestamp >= self.period_end:
+            # Split the trapezoid where the period rolls over.
+            end = self.period_end
+            end_power = start_power + (power - start_power) * (end - start) / (
+                timestamp - start
+            )
+            self.energy += (start_power + end_power) / 2 * (end - start) / 3600
+            self._add_to_ring(start, end, start_power, end_power)
+            _LOGGER.debug("Used %.1f Wh in the last period", self.energy)
+            self.period_start = end
+            self.energy = 0.0
+            start = end
+            start_power = end_power
+
+        self.energy += (start_power + power) / 2 * (timestamp - start) / 3600
+        self._add_to_ring(start, timestamp, start_power, power)
+        self._last_ts = timestamp
+        self._last_power = power
+
+    @property
+    def average_power(self):
+        """Average power in watts over the history we have."""
+        if self._last_ts is None:
+            return 0.0
+        oldest = (self._slot - self._size + 1) * self.slot_seconds
+        covered = self._last_ts - max(self._first_ts, oldest)
+        if covered <= 0:
+            return self._last_power
+        return self._recent * 3600 / covered
+
+    @property
+    def remaining(self):
+        """Seconds left of the current period."""
+        if self._last_ts is None:
+            return self.period
+        return self.period_end - self._last_ts
+
+    def projected(self, extra_power=0.0):
+        """Energy we expect to have used when the period ends, in Wh."""
+        if self._last_ts is None:
+            return 0.0
+        return self.energy + (self.average_power + extra_power) * self.remaining / 3600
+
+    def watts_to_shed(self, limit, extra_power=0.0):
+        """How many watts we need to turn off to end the period under limit."""
+        over = self.projected(extra_power) - limit
+        if over <= 0:
+            return 0.0
+        return over * 3600 / max(self.remaining, self.slot_seconds)
+
+    def dump(self):
+        """Compact list of everything we need to carry on after a restart."""
+        return [
+            self.period_start,
+            self.energy,
+            self._first_ts,
+            self._last_ts,
+            self._last_power,
+            self._slot,
+            self._recent,
+            list(self._slots),
+        ]
+
+    def load(self, data):
+        """Carry on from what dump returned."""
+        slots = data[7]
+        if len(slots) != self._size:
+            return
+        (
+            self.period_start,
+            self.energy,
+            self._first_ts,
+            self._last_ts,
+            self._last_power,
+            self._slot,
+            self._recent,
+        ) = data[:7]
+        self._slots = array("d", slots)
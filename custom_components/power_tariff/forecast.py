@@ -0,0 +1,90 @@
+"""Short horizon forecast of the power usage."""
+import math
+
+DEFAULT_LEVEL_SMOOTHING = 300.0
+DEFAULT_TREND_SMOOTHING = 900.0
+DEFAULT_TREND_HORIZON = 600.0
+
+
+class LoadForecaster:
+    """Exponential smoothing of the power usage and its trend (Holt).
+
+    The smoothing factors come from the time between samples, so uneven
+    meter updates are weighted right. Every sample is a handful of float
+    operations and nothing is kept per sample.
+    """
+
+    __slots__ = (
+        "level_smoothing",
+        "trend_smoothing",
+        "trend_horizon",
+        "level",
+        "trend",
+        "_last_ts",
+    )
+
+    def __init__(
+        self,
+        level_smoothing=DEFAULT_LEVEL_SMOOTHING,
+        trend_smoothing=DEFAULT_TREND_SMOOTHING,
+        trend_horizon=DEFAULT_TREND_HORIZON,
+    ):
+        # Seconds, roughly how far back we look.
+        self.level_smoothing = level_smoothing
+        self.trend_smoothing = trend_smoothing
+        # Seconds, the trend is only followed this far ahead. Further out
+        # the power stays where the trend got it, so a trend that turns
+        # around all the time doesnt swing the forecast for the whole hour.
+        self.trend_horizon = trend_horizon
+        # Watts
+        self.level = 0.0
+        # Watts per second
+        self.trend = 0.0
+        self._last_ts = None
+
+    def add(self, timestamp, power):
+        """Add a meter sample, power in watts."""
+        if self._last_ts is None:
+            self.level = power
+            self.trend = 0.0
+            self._last_ts = timestamp
+            return
+
+        elapsed = timestamp - self._last_ts
+        if elapsed <= 0:
+            return
+
+        alpha = 1.0 - math.exp(-elapsed / self.level_smoothing)
+        beta = 1.0 - math.exp(-elapsed / self.trend_smoothing)
+        expected = self.level + self.trend * elapsed
+        level = expected + alpha * (power - expected)
+        self.trend += beta * ((level - self.level) / elapsed - self.trend)
+        self.level = level
+        self._last_ts = timestamp
+
+    def power(self, seconds=0.0):
+        """Power we expect in seconds, never below 0."""
+        return max(self.level + self.trend * min(seconds, self.trend_horizon), 0.0)
+
+    def energy(self, seconds):
+        """Wh we expect to use in the next seconds."""
+        if self._last_ts is None or seconds <= 0:
+            return 0.0
+        ramp = min(seconds, self.trend_horizon)
+        end = self.level + self.trend * ramp
+        return _positive_wh(self.level, end, ramp) + max(end, 0.0) * (
+            seconds - ramp
+        ) / 3600
+
+
+def _positive_wh(start, end, seconds):
+    """Wh under a straight line from start to end watts, where it is above 0."""
+    if start >= 0 and end >= 0:
+        return (start + end) / 2 * seconds / 3600
+    if start <= 0 and end <= 0:
+        return 0.0
+    # Crosses 0 somewhere in between, only count the positive part.
+    crossing = seconds * start / (start - end)
+    if start > 0:
+        return start * crossing / 2 / 3600
+    return end * (seconds - crossing) / 2 / 3600
@@ -0,0 +1,137 @@
+"""Devices that have to be turned off and on together, in order."""
+import logging
+from collections import namedtuple
+
+import homeassistant.helpers.config_validation as cv
+import voluptuous as vol
+from homeassistant.const import SERVICE_TURN_OFF, SERVICE_TURN_ON
+
+_LOGGER = logging.getLogger(__name__)
+
+# stages is a tuple of tuples of turn_on entities, in the order they are
+# turned on. They are turned off in the reverse order.
+GroupSpec = namedtuple("GroupSpec", ["name", "priority", "stages"])
+
+
+def group_spec(conf):
+    """Resolve depends_on into stages, once, when the config is validated."""
+    members = list(dict.fromkeys(conf["devices"]))
+    depends_on = conf.get("depends_on") or {}
+    for entity_id, deps in depends_on.items():
+        for dep in [entity_id] + list(deps):
+            if dep not in members:
+                raise vol.Invalid(
+                    f"{dep} in depends_on is not in group {conf['name']}"
+                )
+
+    # Kahn, a device goes in the stage after the last of its dependencies.
+    waiting = {
+        entity_id: set(depends_on.get(entity_id, ())) for entity_id in members
+    }
+    stages = []
+    while waiting:
+        ready = tuple(
+            entity_id for entity_id in members if waiting.get(entity_id) == set()
+        )
+        if not ready:
+            raise vol.Invalid(f"depends_on in group {conf['name']} has a cycle")
+        for entity_id in ready:
+            del waiting[entity_id]
+        for deps in waiting.values():
+            deps.difference_update(ready)
+        stages.append(ready)
+
+    return GroupSpec(conf["name"], conf.get("priority"), tuple(stages))
+
+
+GROUP_SCHEMA = vol.All(
+    {
+        vol.Required("name"): cv.string,
+        vol.Required("devices"): vol.All(
+            cv.ensure_list, vol.Length(min=1), [cv.string]
+        ),
+        # Defaults to the highest priority of the devices.
+        vol.Optional("priority"): vol.All(vol.Coerce(int), vol.Range(min=1, max=100)),
+        # turn_on entity to the turn_on entities it needs to be on first.
+        vol.Optional("depends_on"): {cv.string: vol.All(cv.ensure_list, [cv.string])},
+    },
+    group_spec,
+)
+
+
+class DeviceGroup:
+    """Stands in for its devices when picking what to turn off or on."""
+
+    __slots__ = ("name", "priority", "members", "anchor")
+
+    def __init__(self, name, priority, members):
+        self.name = name
+        self.priority = priority
+        # In the order they are turned on.
+        self.members = members
+        # The group is placed where this device is in priority order.
+        self.anchor = max(members, key=lambda device: device.priority)
+
+    @property
+    def turn_on_entity(self):
+        return self.name
+
+    def __repr__(self):
+        return f"<DeviceGroup {self.name}>"
+
+
+class DeviceGroups:
+    """The groups of a controller, mapped to the devices we have.
+
+    build() is called when the devices change, so the update only does
+    dict lookups.
+    """
+
+    def __init__(self, specs=()):
+        self.specs = list(specs)
+        self.group_of = {}
+        self.stage_of = {}
+
+    def build(self, devices):
+        by_entity = {device.turn_on_entity: device for device in devices}
+        self.group_of = {}
+        self.stage_of = {}
+        for spec in self.specs:
+            members = []
+            for stage, entity_ids in enumerate(spec.stages):
+                for entity_id in entity_ids:
+                    device = by_entity.get(entity_id)
+                    if device is None:
+                        _LOGGER.warning(
+                            "%s in group %s is not a device", entity_id, spec.name
+                        )
+                        continue
+                    if device in self.group_of:
+                        _LOGGER.warning("%s is in more then one group", entity_id)
+                        continue
+                    members.append(device)
+                    self.stage_of[device] = stage
+            if not members:
+                continue
+            priority = spec.priority or max(device.priority for device in members)
+            group = DeviceGroup(spec.name, priority, tuple(members))
+            for device in members:
+                self.group_of[device] = group
+
+    def stages(self, steps):
+        """Split a plan into stages that have to run one after the other.
+
+        The turn offs go first, in the reverse stage order, then the turn
+        ons in stage order. Every stage has a single service and
+        everything in it can run at the same time.
+        """
+        stages = []
+        for service in (SERVICE_TURN_OFF, SERVICE_TURN_ON):
+            levels = {}
+            for step in steps:
+                if step[1] == service:
+                    level = self.stage_of.get(step[0], 0)
+                    levels.setdefault(level, []).append(step)
+            shed = service == SERVICE_TURN_OFF
+            stages.extend(levels[level] for level in sorted(levels, reverse=shed))
+        return stages
@@ -0,0 +1,122 @@
+"""Per device state so we dont turn devices on and off all the time."""
+
+STATE_ON = "on"
+# Turned off by us, kept off for min_off_time.
+STATE_SHED = "shed"
+# Turned off by us, waiting for enough headroom to turn it on again.
+STATE_COOLDOWN = "cooldown"
+# Turned on again by us, kept on for min_on_time.
+STATE_RESTORING = "restoring"
+# Turned off by the price plan, left alone until the plan releases it.
+STATE_HELD = "held"
+
+
+class DeviceState:
+    """Where a device is in the shed/restore cycle.
+
+    Moving on from SHED and RESTORING only depends on time, so that happens
+    when the state is read instead of needing a timer.
+    """
+
+    __slots__ = (
+        "_state",
+        "since",
+        "hour",
+        "calls",
+        "calls_last_hour",
+        "sheds",
+        "restores",
+    )
+
+    def __init__(self):
+        self._state = STATE_ON
+        self.since = 0.0
+        self.hour = 0
+        self.calls = 0
+        self.calls_last_hour = 0
+        self.sheds = 0
+        self.restores = 0
+
+    def state(self, now, min_off_time, min_on_time):
+        if self._state == STATE_SHED and now - self.since >= min_off_time:
+            self._state = STATE_COOLDOWN
+        elif self._state == STATE_RESTORING and now - self.since >= min_on_time:
+            self._state = STATE_ON
+        return self._state
+
+    def can_shed(self, now, min_off_time, min_on_time):
+        return self.state(now, min_off_time, min_on_time) == STATE_ON
+
+    def can_restore(self, now, min_off_time, min_on_time):
+        return self.state(now, min_off_time, min_on_time) == STATE_COOLDOWN
+
+    def shed(self, now):
+        self._state = STATE_SHED
+        self.since = now
+        self.sheds += 1
+        self._count_call(now)
+
+    def restore(self, now):
+        self._state = STATE_RESTORING
+        self.since = now
+        self.restores += 1
+        self._count_call(now)
+
+    def hold(self, now, called=True):
+        """Off by the plan, called is False if it was off already."""
+        self._state = STATE_HELD
+        self.since = now
+        if called:
+            self.sheds += 1
+            self._count_call(now)
+
+    @property
+    def held(self):
+        return self._state == STATE_HELD
+
+    def release(self):
+        """Let the restore pass turn it on again when there is room."""
+        self._state = STATE_COOLDOWN
+
+    def reset(self):
+        """Back to on, fx when something else turned it on."""
+        self._state = STATE_ON
+
+    def _count_call(self, now):
+        hour = int(now // 3600)
+        if hour != self.hour:
+            self.calls_last_hour = self.calls if hour == self.hour + 1 else 0
+            self.calls = 0
+            self.hour = hour
+        self.calls += 1
+
+    def service_calls_last_hour(self, now):
+        """Service calls for this device in the last whole hour."""
+        hour = int(now // 3600)
+        if hour == self.hour:
+            return self.calls_last_hour
+        if hour == self.hour + 1:
+            return self.calls
+        return 0
+
+    def dump(self):
+        return [
+            self._state,
+            self.since,
+            self.hour,
+            self.calls,
+            self.calls_last_hour,
+            self.sheds,
+            self.restores,
+        ]
+
+    def load(self, data):
+        (
+            self._state,
+            self.since,
+            self.hour,
+            self.calls,
+            self.calls_last_hour,
+            self.sheds,
+            self.restores,
+        ) = data
@@ -0,0 +1,39 @@
+"""Where the power controller gets the power usage from.
+
+A meter is anything that can be called without arguments and returns the
+power usage in watts. Pass one to PowerController to drive it from
+something else than the state machine.
+"""
+import itertools
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class StateMeter:
+    """Reads the power usage from the state of an entity."""
+
+    def __init__(self, hass, entity_id):
+        self.hass = hass
+        self.entity_id = entity_id
+
+    def __call__(self):
+        state = self.hass.states.get(self.entity_id)
+        try:
+            return float(state.state)
+        except (AttributeError, TypeError, ValueError):
+            # unknown state comes to mind.
+            _LOGGER.debug("Cant read the power usage from %s", self.entity_id)
+            return 0.0
+
+
+class CycleMeter:
+    """Repeats the same readings forever, handy when trying things out."""
+
+    def __init__(self, readings=None):
+        if readings is None:
+            readings = [2000] * 6 + [3000] * 6 + [2500] * 6 + [1000] * 6
+        self._readings = itertools.cycle(readings)
+
+    def __call__(self):
+        return float(next(self._readings))
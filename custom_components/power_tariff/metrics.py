@@ -0,0 +1,154 @@
+"""Counters and timings for the power controller.
+
+Everything is allocated up front, recording a value is a bisect and a few
+additions. exposition() renders it all in the prometheus text format.
+"""
+import time
+from array import array
+from bisect import bisect_left
+
+# Seconds
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count", "last")
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # The last one is +Inf.
+        self.counts = array("L", [0]) * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.last = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.last = value
+
+    @property
+    def average(self):
+        return self.sum / self.count if self.count else 0.0
+
+    def exposition(self, name, labels=""):
+        lines = []
+        sep = "," if labels else ""
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+        cumulative += self.counts[-1]
+        lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {cumulative}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.sum}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+        return lines
+
+
+class Metrics:
+    """Everything we measure for one power controller."""
+
+    __slots__ = (
+        "update_latency",
+        "tariff_lookup",
+        "service_latency",
+        "service_calls",
+        "service_failures",
+        "service_not_found",
+        "samples_received",
+        "samples_coalesced",
+        "samples_processed",
+        "headroom",
+    )
+
+    def __init__(self):
+        self.update_latency = Histogram()
+        self.tariff_lookup = Histogram()
+        self.service_latency = Histogram()
+        self.service_calls = 0
+        self.service_failures = 0
+        self.service_not_found = 0
+        # Meter samples, see coalesce.UpdateCoalescer.
+        self.samples_received = 0
+        self.samples_coalesced = 0
+        self.samples_processed = 0
+        # Watts (or Wh in energy mode) left before we hit the limit.
+        self.headroom = 0.0
+
+
+def _labels(labels, extra):
+    if labels and extra:
+        return f"{{{labels},{extra}}}"
+    if labels or extra:
+        return f"{{{labels}{extra}}}"
+    return ""
+
+
+def exposition(entries, now=None):
+    """Render the metrics in the prometheus text format.
+
+    entries is a list of (labels, metrics, device_states), where labels is
+    something like 'controller="house"' or "".
+    """
+    if now is None:
+        now = time.time()
+    lines = []
+    for name, attr in (
+        ("power_tariff_update_seconds", "update_latency"),
+        ("power_tariff_tariff_lookup_seconds", "tariff_lookup"),
+        ("power_tariff_service_call_seconds", "service_latency"),
+    ):
+        lines.append(f"# TYPE {name} histogram")
+        for labels, metrics, _ in entries:
+            lines.extend(getattr(metrics, attr).exposition(name, labels))
+
+    name = "power_tariff_service_calls_total"
+    lines.append(f"# TYPE {name} counter")
+    for labels, metrics, _ in entries:
+        lines.append(f"{name}{_labels(labels, '')} {metrics.service_calls}")
+
+    name = "power_tariff_service_failures_total"
+    not_found = 'reason="service_not_found"'
+    error = 'reason="error"'
+    lines.append(f"# TYPE {name} counter")
+    for labels, metrics, _ in entries:
+        lines.append(f"{name}{_labels(labels, not_found)} {metrics.service_not_found}")
+        lines.append(f"{name}{_labels(labels, error)} {metrics.service_failures}")
+
+    for name, attr in (
+        ("power_tariff_samples_received_total", "samples_received"),
+        ("power_tariff_samples_coalesced_total", "samples_coalesced"),
+        ("power_tariff_samples_processed_total", "samples_processed"),
+    ):
+        lines.append(f"# TYPE {name} counter")
+        for labels, metrics, _ in entries:
+            lines.append(f"{name}{_labels(labels, '')} {getattr(metrics, attr)}")
+
+    name = "power_tariff_headroom"
+    lines.append(f"# TYPE {name} gauge")
+    for labels, metrics, _ in entries:
+        lines.append(f"{name}{_labels(labels, '')} {metrics.headroom}")
+
+    name = "power_tariff_service_calls_last_hour"
+    lines.append(f"# TYPE {name} gauge")
+    for labels, _, device_states in entries:
+        calls = sum(
+            state.service_calls_last_hour(now) for state in device_states.values()
+        )
+        lines.append(f"{name}{_labels(labels, '')} {calls}")
+
+    for name, attr in (
+        ("power_tariff_device_shed_total", "sheds"),
+        ("power_tariff_device_restore_total", "restores"),
+    ):
+        lines.append(f"# TYPE {name} counter")
+        for labels, _, device_states in entries:
+            for device, state in device_states.items():
+                entity = f'entity="{device.turn_on_entity}"'
+                lines.append(
+                    f"{name}{_labels(labels, entity)} {getattr(state, attr)}"
+                )
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,58 @@
+"""Per phase currents, the main fuse trips on the worst phase and not the total."""
+import logging
+
+from .const import DEFAULT_VOLTAGE
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class PhaseMeter:
+    """Reads the current on every phase and works out what a device draws on each.
+
+    Everything is a tuple with one value per phase in the order the phases
+    are configured, so the math is a single pass over a handful of values.
+    """
+
+    def __init__(self, hass, entities, fuse_amps, voltage=DEFAULT_VOLTAGE):
+        self.hass = hass
+        self.names = tuple(entities)
+        self.entities = tuple(entities[name] for name in self.names)
+        self.fuse_amps = fuse_amps
+        self.voltage = voltage
+        self._all = tuple(range(len(self.names)))
+
+    def index(self, phases):
+        """Positions of phases, a device without phases is on all of them."""
+        if not phases:
+            return self._all
+        idx = []
+        for phase in phases:
+            if phase in self.names:
+                idx.append(self.names.index(phase))
+            else:
+                _LOGGER.warning("Unknown phase %s, known phases %s", phase, self.names)
+        return tuple(idx) or self._all
+
+    def read(self):
+        """Amps on every phase, 0 if we cant read it."""
+        amps = []
+        for entity_id in self.entities:
+            state = self.hass.states.get(entity_id)
+            try:
+                amps.append(float(state.state))
+            except (AttributeError, TypeError, ValueError):
+                amps.append(0.0)
+        return tuple(amps)
+
+    def excess(self, amps):
+        """Amps over the fuse on every phase, negative is headroom."""
+        fuse = self.fuse_amps
+        return tuple(value - fuse for value in amps)
+
+    def device_amps(self, index, power_usage):
+        """Spread power_usage evenly over the phases in index."""
+        per_phase = power_usage / (self.voltage * len(index))
+        amps = [0.0] * len(self.names)
+        for pos in index:
+            amps[pos] = per_phase
+        return tuple(amps)
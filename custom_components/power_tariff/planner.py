@@ -0,0 +1,88 @@
+"""Plan when the deferrable devices run from the hourly spot prices."""
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+HOUR = 3600
+
+
+class PricePlanner:
+    """The cheapest hours for every deferrable device, one day at the time.
+
+    A day is only planned again when its prices (or the devices) change, so
+    the price sensor getting tomorrows prices doesnt move what we planned
+    for today.
+    """
+
+    def __init__(self, base_load=0.0):
+        # Watts we expect the rest of the house to use, taken off the cap.
+        self.base_load = base_load
+        # Day start -> (key, hours, plan)
+        self._days = {}
+
+    def update(self, day_start, prices, devices, caps):
+        """Plan the day starting at day_start, returns True if the plan changed.
+
+        prices has one price per hour from day_start, None if we dont know
+        it. devices is a list of (device, watts, run_hours), the most
+        important first. caps is the Wh we may use in every hour.
+        """
+        key = (tuple(prices), tuple(devices), tuple(caps))
+        known = self._days.get(day_start)
+        if known is not None and known[0] == key:
+            return False
+
+        _LOGGER.debug("Planning the day starting at %s", day_start)
+        self._days[day_start] = (key, len(prices), self._solve(prices, devices, caps))
+        return True
+
+    def _solve(self, prices, devices, caps):
+        """Give every device its cheapest hours that still fit under the cap."""
+        left = [cap - self.base_load for cap in caps]
+        order = sorted(
+            (hour for hour, price in enumerate(prices) if price is not None),
+            key=prices.__getitem__,
+        )
+        plan = {}
+        for device, power, run_hours in devices:
+            hours = set()
+            for hour in order:
+                if len(hours) == run_hours:
+                    break
+                if left[hour] >= power:
+                    left[hour] -= power
+                    hours.add(hour)
+            if len(hours) < run_hours:
+                _LOGGER.warning(
+                    "Only found %s of %s hours for %s under the limit",
+                    len(hours),
+                    run_hours,
+                    device.turn_on_entity,
+                )
+            plan[device] = hours
+        return plan
+
+    def prune(self, now):
+        """Forget the days that are over."""
+        for day_start, (_, hours, _) in list(self._days.items()):
+            if day_start + hours * HOUR <= now:
+                del self._days[day_start]
+
+    def wanted(self, device, now):
+        """If device should run at now, None if we have no plan for now."""
+        for day_start, (_, hours, plan) in self._days.items():
+            if day_start <= now < day_start + hours * HOUR:
+                if device not in plan:
+                    return None
+                return int((now - day_start) // HOUR) in plan[device]
+        return None
+
+    def next_hour(self, now):
+        """When the next planned hour starts, None if there are none."""
+        starts = []
+        for day_start, (_, hours, _) in self._days.items():
+            if day_start > now:
+                starts.append(day_start)
+            elif now < day_start + hours * HOUR:
+                starts.append(day_start + (int((now - day_start) // HOUR) + 1) * HOUR)
+        return min(starts, default=None)
@@ -0,0 +1,49 @@
+"""Keep track of the devices we have turned off."""
+from bisect import bisect_left, bisect_right
+
+
+class ShedDevices:
+    """The devices we have turned off, highest priority first.
+
+    Remembers how much each device used before we turned it off, as an off
+    device usually reports close to nothing. The restore pass only has to
+    look at these instead of every device.
+    """
+
+    def __init__(self):
+        # Negative priority so the highest priority sorts first.
+        self._keys = []
+        self._devices = []
+        # The key a device was added with, its priority can change on reload.
+        self._device_keys = {}
+        self.power_usage = {}
+
+    def add(self, device, power_usage):
+        if device in self.power_usage:
+            self.power_usage[device] = power_usage
+            return
+
+        key = -device.priority
+        idx = bisect_right(self._keys, key)
+        self._keys.insert(idx, key)
+        self._devices.insert(idx, device)
+        self._device_keys[device] = key
+        self.power_usage[device] = power_usage
+
+    def remove(self, device):
+        if self.power_usage.pop(device, None) is None:
+            return
+
+        start = bisect_left(self._keys, self._device_keys.pop(device))
+        idx = self._devices.index(device, start)
+        del self._keys[idx]
+        del self._devices[idx]
+
+    def __contains__(self, device):
+        return device in self.power_usage
+
+    def __iter__(self):
+        return iter(self._devices)
+
+    def __len__(self):
+        return len(self._devices)
@@ -0,0 +1,136 @@
+"""Precompiled index of which tariff is active when."""
+import logging
+from bisect import bisect_right
+from datetime import datetime, time, timedelta
+
+import homeassistant.util.dt as dt_util
+
+from .tariff import END_OF_DAY
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_HORIZON_DAYS = 7
+
+
+def local_datetime(day, at_time):
+    """day at at_time in the local time zone, with the offset that applies then."""
+    naive = datetime.combine(day, at_time)
+    time_zone = dt_util.DEFAULT_TIME_ZONE
+    if hasattr(time_zone, "localize"):
+        # pytz, replace would keep the offset from before a DST change.
+        return time_zone.localize(naive)
+    return naive.replace(tzinfo=time_zone)
+
+
+def start_of_local_day(day):
+    """Local midnight at the start of day, a date.
+
+    dt_util.start_of_local_day only takes a date from HA 2021.1.
+    """
+    return local_datetime(day, time.min)
+
+
+def pick_tariff(tariffs, now=None):
+    """Return the first enabled tariff that is valid at now, or None."""
+    for tariff in tariffs:
+        if tariff.enabled and tariff.valid(now):
+            return tariff
+    return None
+
+
+class TariffSchedule:
+    """Sorted transition timestamps for the next horizon_days days.
+
+    Each transition maps to the tariff that is active until the next one,
+    so finding the active tariff is a bisect instead of calling
+    Tariff.valid() on every tariff. The result is cached until the next
+    transition, so most lookups are just two float compares.
+    """
+
+    def __init__(self, tariffs, horizon_days=DEFAULT_HORIZON_DAYS):
+        self.tariffs = tariffs
+        self.horizon_days = horizon_days
+        self._starts = []
+        self._active = []
+        self._end = 0.0
+        self._cached = None
+        self._cached_from = 0.0
+        self._cached_until = 0.0
+
+    def invalidate(self):
+        """Drop the index, the next lookup rebuilds it."""
+        self._starts = []
+        self._active = []
+        self._end = 0.0
+        self._cached = None
+        self._cached_from = 0.0
+        self._cached_until = 0.0
+
+    def _boundaries(self, today):
+        # Tariffs often share their times, only put every time on a day once.
+        times = set()
+        for tariff in self.tariffs:
+            restrictions = tariff.restrictions
+            if tariff.enabled and restrictions:
+                times.update((restrictions.time_start, restrictions.time_end))
+        # Midnight is already there.
+        times.discard(END_OF_DAY)
+
+        points = set()
+        for offset in range(self.horizon_days + 1):
+            day = today + timedelta(days=offset)
+            points.add(start_of_local_day(day).timestamp())
+            for t in times:
+                points.add(local_datetime(day, t).timestamp())
+        return points
+
+    def build(self, now=None):
+        """Compile the tariffs into transitions starting at local midnight today."""
+        now = now or dt_util.now()
+        today = now.date()
+        last_day = today + timedelta(days=self.horizon_days + 1)
+        end = start_of_local_day(last_day).timestamp()
+        points = sorted(p for p in self._boundaries(today) if p < end)
+
+        starts = []
+        active = []
+        for idx, start in enumerate(points):
+            stop = points[idx + 1] if idx + 1 < len(points) else end
+            # Evaluate in the middle of the segment so we never hit the
+            # strict comparisons in Tariff.valid() on the edges.
+            middle = dt_util.as_local(dt_util.utc_from_timestamp((start + stop) / 2))
+            tariff = pick_tariff(self.tariffs, middle)
+            if active and active[-1] is tariff:
+                continue
+            starts.append(start)
+            active.append(tariff)
+
+        self._starts = starts
+        self._active = active
+        self._end = end
+        self._cached_until = 0.0
+        _LOGGER.debug(
+            "Compiled %s tariffs into %s transitions", len(self.tariffs), len(starts)
+        )
+
+    def lookup(self, timestamp):
+        """Return the tariff active at timestamp, or None."""
+        if self._cached_from <= timestamp < self._cached_until:
+            return self._cached
+
+        if not self._starts or not self._starts[0] <= timestamp < self._end:
+            self.build(dt_util.as_local(dt_util.utc_from_timestamp(timestamp)))
+
+        idx = bisect_right(self._starts, timestamp) - 1
+        self._cached = self._active[idx]
+        self._cached_from = self._starts[idx]
+        if idx + 1 < len(self._starts):
+            self._cached_until = self._starts[idx + 1]
+        else:
+            self._cached_until = self._end
+        return self._cached
+
+    @property
+    def next_boundary(self):
+        """Timestamp where the cached tariff stops being valid."""
+        return self._cached_until
@@ -1,9 +1,14 @@
+import hashlib
+import json
 import logging
+from collections import namedtuple
 
 import homeassistant.helpers.config_validation as cv
 import voluptuous as vol
 from homeassistant.const import WEEKDAYS
 
+from .tariff import Tariff
+from .throttle import THROTTLE_SCHEMA
 from .validators import validate_date
 
 _LOGGER = logging.getLogger(__name__)
@@ -14,27 +19,41 @@ _UNDEF = object()
 def vad(value, schema):
     """Helper to create default config and replace them with
        the one that the user has given.
+
+    Every key in schema has a default, so validating once gives the same
+    as validating {} and updating it with what the user has given.
     """
+    if value is None or value is _UNDEF:
+        value = {}
+    elif not isinstance(value, dict):
+        raise vol.Invalid(f"expected a dictionary, got {value!r}")
+
+    defs = schema(value)
+    _LOGGER.debug("%r", defs)
+    return defs
+
 
-    if isinstance(value, dict):
-        # Validate and  convert to the correct type.
-        values = schema(value)
-        # Create the default values
-        defs = schema({})
-        # Replace default values with what the user have given.
-        defs.update(values)
-        _LOGGER.debug("%r", defs)
-        return defs
+def cache_validation(schema, size=4):
+    """Skip validating a config we have validated before.
 
-    elif value is None:
-        defs = schema({})
-        _LOGGER.debug("Value was None %r", defs)
-        return defs
+    The result is reused, so it must not be changed.
+    """
+    cache = {}
+
+    def validate(value):
+        key = hashlib.sha1(
+            json.dumps(value, sort_keys=True, default=str).encode()
+        ).hexdigest()
+        if key in cache:
+            _LOGGER.debug("Config hasnt changed, skipping validation")
+            return cache[key]
+        result = schema(value)
+        if len(cache) >= size:
+            cache.pop(next(iter(cache)))
+        cache[key] = result
+        return result
 
-    elif value is _UNDEF:
-        defs = schema({})
-        _LOGGER.debug("_UNDEF %r", defs)
-        return defs
+    return validate
 
 
 TIME_SCHEMA = vol.Schema(
@@ -64,7 +83,7 @@ DAY_SCHEMA = vol.Schema(
     }
 )
 
-TARIFF_SCHEMA = vol.Schema(
+TARIFF_SCHEMA = vol.All(
     {
         vol.Required("name", default="dag"): cv.string,
         vol.Required("limit_kwh", default=1000): int,
@@ -73,10 +92,42 @@ TARIFF_SCHEMA = vol.Schema(
         #  The restrictions can be completely omitted and default config is still created.
         vol.Optional("restrictions"): vol.All(lambda value: vad(value, DAY_SCHEMA)),
         vol.Optional("enabled", default=True): cv.boolean,
-    }
+    },
+    Tariff.from_config,
 )
 
-DEVICE_SCHEMA = vol.Schema(
+DeviceSpec = namedtuple(
+    "DeviceSpec",
+    [
+        "turn_on",
+        "turn_off",
+        "priority",
+        "enabled",
+        "power_usage",
+        "assumed_usage",
+        "phases",
+        "run_hours",
+        "throttle",
+    ],
+)
+
+
+def device_spec(conf):
+    """Freeze a validated device config."""
+    return DeviceSpec(
+        conf["turn_on"],
+        conf.get("turn_off"),
+        conf["priority"],
+        conf["enabled"],
+        conf.get("power_usage"),
+        conf["assumed_usage"],
+        tuple(conf["phases"]),
+        conf.get("run_hours"),
+        conf.get("throttle"),
+    )
+
+
+DEVICE_SCHEMA = vol.All(
     {
         vol.Required(
             "turn_on"
@@ -92,5 +143,12 @@ DEVICE_SCHEMA = vol.Schema(
         vol.Optional(
             "assumed_usage", default=0.0
         ): float,  # Backup if we dont have way to get the device power usage
-    }
+        # The phases the device is connected to, all of them if missing.
+        vol.Optional("phases", default=[]): vol.All(cv.ensure_list, [cv.string]),
+        # Hours a day the device has to run, the planner picks the cheapest.
+        vol.Optional("run_hours"): vol.All(vol.Coerce(int), vol.Range(min=1, max=24)),
+        # A setpoint we can turn down instead of turning the device off.
+        vol.Optional("throttle"): THROTTLE_SCHEMA,
+    },
+    device_spec,
 )
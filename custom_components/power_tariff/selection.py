@@ -0,0 +1,118 @@
+"""Strategies for picking which devices to turn off.
+
+Every strategy takes a list of (device, power_usage) tuples, sorted by
+priority, and the number of watts we need to get rid of. It returns the
+devices that should be turned off.
+"""
+import logging
+import math
+import time
+from array import array
+
+_LOGGER = logging.getLogger(__name__)
+
+STRATEGY_GREEDY = "greedy"
+STRATEGY_EXACT = "exact"
+
+# Upper bound on the dp table width, the watt resolution is scaled to fit.
+MAX_CELLS = 2000
+
+
+def greedy(candidates, excess, time_budget=None):
+    """Turn off devices in priority order until we are under the limit."""
+    devs = []
+    for device, power_usage in candidates:
+        devs.append(device)
+        excess -= power_usage
+        if excess <= 0:
+            _LOGGER.debug("Reached the limit..")
+            break
+
+    return devs
+
+
+def exact(candidates, excess, time_budget=0.05):
+    """Find the set of devices that covers excess with the least shed watts
+    weighted by priority.
+
+    This is a covering knapsack solved with dp over the watts to shed. If we
+    can't cover excess at all, or we run past time_budget, use greedy.
+    """
+    if excess <= 0:
+        return []
+
+    started = time.monotonic()
+    resolution = max(1.0, excess / MAX_CELLS)
+    cap = int(math.ceil(excess / resolution))
+
+    inf = float("inf")
+    cost = [inf] * (cap + 1)
+    cost[0] = 0.0
+    parents = []
+
+    for device, power_usage in candidates:
+        # Round down so the picked set never sheds less than we think.
+        weight = int(power_usage // resolution)
+        if weight <= 0:
+            parents.append(None)
+            continue
+
+        price = power_usage * device.priority
+        parent = array("i", [-1]) * (cap + 1)
+        for used in range(cap, -1, -1):
+            if cost[used] == inf:
+                continue
+            target = min(cap, used + weight)
+            if cost[used] + price < cost[target]:
+                cost[target] = cost[used] + price
+                parent[target] = used
+        parents.append(parent)
+
+        if time.monotonic() - started > time_budget:
+            _LOGGER.debug("Exact selection ran out of time, using greedy")
+            return greedy(candidates, excess)
+
+    if cost[cap] == inf:
+        _LOGGER.debug("Can't get under the limit, using greedy")
+        return greedy(candidates, excess)
+
+    devs = []
+    used = cap
+    for idx in range(len(candidates) - 1, -1, -1):
+        parent = parents[idx]
+        if parent is not None and parent[used] != -1:
+            devs.append(candidates[idx][0])
+            used = parent[used]
+
+    devs.reverse()
+    return devs
+
+
+def by_phase(candidates, phase_excess, picked=()):
+    """Turn off devices in priority order until no phase is over the fuse.
+
+    Devices in picked are already turned off, what they draw is taken off
+    first. Devices that dont draw anything on an overloaded phase are
+    skipped, so this is one pass over the candidates.
+    """
+    remaining = list(phase_excess)
+    for device in picked:
+        remaining = [left - amps for left, amps in zip(remaining, device.phase_amps)]
+
+    devs = []
+    picked = set(picked)
+    for device, _ in candidates:
+        if all(left <= 0 for left in remaining):
+            break
+        if device in picked:
+            continue
+        amps = device.phase_amps
+        if not any(left > 0 and value > 0 for left, value in zip(remaining, amps)):
+            continue
+        devs.append(device)
+        remaining = [left - value for left, value in zip(remaining, amps)]
+
+    return devs
+
+
+STRATEGIES = {STRATEGY_GREEDY: greedy, STRATEGY_EXACT: exact}
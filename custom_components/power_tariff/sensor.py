@@ -0,0 +1,82 @@
+"""Diagnostic sensors for the power controller."""
+import logging
+
+from homeassistant.helpers.entity import Entity
+
+from .const import DOMAIN, LIMIT_MODE_POWER
+
+_LOGGER = logging.getLogger(__name__)
+
+
+async def async_setup_platform(
+    hass, config, async_add_entities, discovery_info=None
+):  # pylint: disable=unused-argument
+    pc = hass.data[DOMAIN][discovery_info["controller"]]
+    # The limit is on the energy used this hour in the other modes.
+    headroom_unit = "W" if pc.limit_mode == LIMIT_MODE_POWER else "Wh"
+    async_add_entities(
+        [
+            MetricSensor(
+                pc,
+                "update_latency",
+                "ms",
+                lambda m: round(m.update_latency.average * 1000, 3),
+            ),
+            MetricSensor(
+                pc,
+                "tariff_lookup",
+                "ms",
+                lambda m: round(m.tariff_lookup.average * 1000, 3),
+            ),
+            MetricSensor(
+                pc,
+                "service_call_latency",
+                "ms",
+                lambda m: round(m.service_latency.average * 1000, 3),
+            ),
+            MetricSensor(pc, "service_calls", None, lambda m: m.service_calls),
+            MetricSensor(
+                pc,
+                "service_failures",
+                None,
+                lambda m: m.service_failures + m.service_not_found,
+            ),
+            MetricSensor(
+                pc,
+                "service_calls_last_hour",
+                None,
+                lambda m: pc.service_calls_last_hour(),
+            ),
+            MetricSensor(pc, "samples_received", None, lambda m: m.samples_received),
+            MetricSensor(pc, "samples_coalesced", None, lambda m: m.samples_coalesced),
+            MetricSensor(pc, "samples_processed", None, lambda m: m.samples_processed),
+            MetricSensor(
+                pc, "headroom", headroom_unit, lambda m: round(m.headroom, 1)
+            ),
+        ],
+        False,
+    )
+
+
+class MetricSensor(Entity):
+    """Show one of the power controller metrics."""
+
+    def __init__(self, pc, key, unit, value):
+        self.pc = pc
+        self._key = key
+        self._unit = unit
+        self._value = value
+
+    @property
+    def name(self):
+        if self.pc.name:
+            return f"{DOMAIN}_{self.pc.name}_{self._key}"
+        return f"{DOMAIN}_{self._key}"
+
+    @property
+    def state(self):
+        return self._value(self.pc.metrics)
+
+    @property
+    def unit_of_measurement(self):
+        return self._unit
@@ -0,0 +1,297 @@
+"""Replay recorded meter readings through the power controller.
+
+    python -m custom_components.power_tariff.simulate configuration.yaml meter.csv
+
+The readings are streamed, so the file can be as large as you like. The
+clock is the timestamp of each reading and the service calls only flip a
+flag on simulated devices. The tariff restrictions are in the time zone
+from homeassistant: time_zone in the config, or --time-zone. Turned off
+devices are subtracted from the recorded readings.
+"""
+import argparse
+import asyncio
+import csv
+import logging
+import os
+from collections import namedtuple
+
+import homeassistant.util.dt as dt_util
+from homeassistant.const import ATTR_ENTITY_ID, SERVICE_TURN_ON
+from homeassistant.util.yaml import load_yaml
+
+from . import CONFIG_SCHEMA, PowerController
+from .const import DOMAIN
+from .dispatch import SERVICE_SET_VALUE
+from .exceptions import NoValidTariff
+
+_LOGGER = logging.getLogger(__name__)
+
+Result = namedtuple(
+    "Result",
+    [
+        "samples",
+        "turned_on",
+        "turned_off",
+        "setpoint_changes",
+        "seconds_over_limit",
+        "peak_hour_kwh",
+        "peak_hour",
+    ],
+)
+
+
+def _parse_timestamp(value):
+    try:
+        return float(value)
+    except ValueError:
+        return dt_util.as_timestamp(value)
+
+
+def read_csv(path, timestamp_column="timestamp", value_column="value"):
+    """Yield (timestamp, watts) from a csv file, skipping unknown readings."""
+    with open(path, newline="") as fh:
+        for row in csv.DictReader(fh):
+            try:
+                value = float(row[value_column])
+            except (TypeError, ValueError):
+                continue
+            yield _parse_timestamp(row[timestamp_column]), value
+
+
+def read_parquet(path, timestamp_column="timestamp", value_column="value"):
+    """Yield (timestamp, watts) from a parquet file, one batch at the time."""
+    try:
+        import pyarrow.parquet as pq  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        raise RuntimeError("Reading parquet files requires pyarrow")
+
+    parquet = pq.ParquetFile(path)
+    for batch in parquet.iter_batches(columns=[timestamp_column, value_column]):
+        timestamps = batch.column(0).to_pylist()
+        values = batch.column(1).to_pylist()
+        for timestamp, value in zip(timestamps, values):
+            if value is None:
+                continue
+            if hasattr(timestamp, "timestamp"):
+                timestamp = timestamp.timestamp()
+            yield float(timestamp), float(value)
+
+
+class SimDevice:
+    """Stands in for PowerDevice, the proxy device is just a flag."""
+
+    def __init__(self, spec):
+        self.action = None
+        self.priority = spec.priority
+        self.assumed_usage = spec.assumed_usage
+        self.turn_on_entity = spec.turn_on
+        self.phases = spec.phases
+        self.run_hours = spec.run_hours
+        self.throttle = spec.throttle
+        self.turn_off_entity = spec.turn_off or self.turn_on_entity
+        self.is_on = spec.enabled
+        self.proxy_on = True
+        # assumed_usage is what it uses at the max setpoint.
+        self.setpoint = spec.throttle.max if spec.throttle else None
+
+    def get_power_usage(self):
+        if self.throttle:
+            return self.setpoint * self.throttle.watts_per_unit
+        return float(self.assumed_usage)
+
+    def is_proxy_device_on(self):
+        return self.proxy_on
+
+    def is_proxy_device_off(self):
+        return not self.proxy_on
+
+
+class SimServices:
+    """Fake service registry that switches the simulated devices."""
+
+    def __init__(self, devices):
+        self.entities = {}
+        self.setpoints = {
+            device.throttle.entity: device for device in devices if device.throttle
+        }
+        for device in devices:
+            self.entities.setdefault(device.turn_on_entity, []).append(device)
+            if device.turn_off_entity != device.turn_on_entity:
+                self.entities.setdefault(device.turn_off_entity, []).append(device)
+        self.turned_on = 0
+        self.turned_off = 0
+        self.setpoint_changes = 0
+        # Watts the devices we have turned off would have used.
+        self.shed_power = 0.0
+
+    async def async_call(self, domain, service, service_data, blocking=False):
+        if service == SERVICE_SET_VALUE:
+            device = self.setpoints[service_data[ATTR_ENTITY_ID]]
+            if device.proxy_on:
+                self.shed_power += device.get_power_usage()
+                device.setpoint = service_data["value"]
+                self.shed_power -= device.get_power_usage()
+            else:
+                device.setpoint = service_data["value"]
+            self.setpoint_changes += 1
+            return
+
+        turn_on = service == SERVICE_TURN_ON
+        for entity_id in service_data[ATTR_ENTITY_ID]:
+            for device in self.entities.get(entity_id, ()):
+                if device.proxy_on is turn_on:
+                    continue
+                device.proxy_on = turn_on
+                if turn_on:
+                    self.turned_on += 1
+                    self.shed_power -= device.get_power_usage()
+                else:
+                    self.turned_off += 1
+                    self.shed_power += device.get_power_usage()
+
+
+class SimConfig:
+    """Relative paths, like audit_file, are from where the simulator runs."""
+
+    def __init__(self, config_dir=None):
+        self.config_dir = config_dir or os.getcwd()
+
+    def path(self, *path):
+        return os.path.join(self.config_dir, *path)
+
+
+class SimHass:
+    """Just enough of hass for the power controller."""
+
+    def __init__(self, devices):
+        self.data = {}
+        # Nothing to read, setpoints start at max.
+        self.states = {}
+        self.services = SimServices(devices)
+        self.config = SimConfig()
+
+    def async_add_executor_job(self, target, *args):
+        # Nothing else is running, so there is no reason to wait for a thread.
+        future = asyncio.get_event_loop().create_future()
+        future.set_result(target(*args))
+        return future
+
+
+async def simulate(config, samples):
+    """Run samples through a power controller set up from config."""
+    devices = [SimDevice(device) for device in config.get("devices") or []]
+    hass = SimHass(devices)
+    pc = PowerController(hass, config)
+    pc.add_tariff(list(config.get("tariffs") or []))
+    pc.add_device(devices)
+    # Nothing to load from before a restart.
+    pc.ready = True
+    services = hass.services
+
+    count = 0
+    seconds_over_limit = 0.0
+    hour = None
+    hour_wh = 0.0
+    peak_hour = None
+    peak_hour_wh = 0.0
+    last_ts = None
+    last_usage = 0.0
+    last_over = False
+
+    for timestamp, reading in samples:
+        count += 1
+        usage = max(reading - services.shed_power, 0.0)
+
+        if last_ts is not None:
+            elapsed = timestamp - last_ts
+            if last_over:
+                seconds_over_limit += elapsed
+            hour_wh += last_usage * elapsed / 3600
+
+        this_hour = int(timestamp // 3600)
+        if this_hour != hour:
+            if hour_wh > peak_hour_wh:
+                peak_hour_wh = hour_wh
+                peak_hour = hour
+            hour = this_hour
+            hour_wh = 0.0
+
+        previous = pc.current_tariff
+        try:
+            pc.check_tariff(timestamp)
+        except NoValidTariff:
+            pass
+        if pc.current_tariff is not previous:
+            pc.first_over_limit = None
+
+        await pc.update(usage, timestamp)
+
+        last_ts = timestamp
+        last_usage = usage
+        last_over = (
+            pc.current_tariff is not None and usage > pc.current_tariff.tariff_limit
+        )
+
+    if hour_wh > peak_hour_wh:
+        peak_hour_wh = hour_wh
+        peak_hour = hour
+    # The last decisions, that didnt fill a batch.
+    pc.async_flush_audit()
+
+    return Result(
+        count,
+        services.turned_on,
+        services.turned_off,
+        services.setpoint_changes,
+        seconds_over_limit,
+        peak_hour_wh / 1000,
+        None if peak_hour is None else dt_util.utc_from_timestamp(peak_hour * 3600),
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("config", help="yaml file with the power_tariff config")
+    parser.add_argument("meter", help="csv or parquet file with the meter readings")
+    parser.add_argument("--timestamp-column", default="timestamp")
+    parser.add_argument("--value-column", default="value")
+    parser.add_argument(
+        "--controller", help="name of the controller, defaults to the first one"
+    )
+    parser.add_argument(
+        "--time-zone",
+        help="time zone for the tariff restrictions, defaults to the time_zone "
+        "under homeassistant in the config, or UTC",
+    )
+    args = parser.parse_args(argv)
+
+    config = load_yaml(args.config)
+    time_zone = args.time_zone or (config.get("homeassistant") or {}).get("time_zone")
+    if time_zone:
+        tz = dt_util.get_time_zone(time_zone)
+        if tz is None:
+            parser.error(f"Unknown time zone {time_zone}")
+        dt_util.set_default_time_zone(tz)
+    if DOMAIN not in config:
+        config = {DOMAIN: config}
+    configs = CONFIG_SCHEMA(config)[DOMAIN]
+    if args.controller:
+        configs = [conf for conf in configs if conf.get("name") == args.controller]
+        if not configs:
+            parser.error(f"No controller named {args.controller}")
+    config = configs[0]
+
+    reader = read_parquet if args.meter.endswith(".parquet") else read_csv
+    samples = reader(args.meter, args.timestamp_column, args.value_column)
+    result = asyncio.run(simulate(config, samples))
+
+    print(f"Samples:            {result.samples}")
+    print(f"Devices turned off: {result.turned_off}")
+    print(f"Devices turned on:  {result.turned_on}")
+    print(f"Setpoint changes:   {result.setpoint_changes}")
+    print(f"Seconds over limit: {result.seconds_over_limit:.0f}")
+    print(f"Peak hour:          {result.peak_hour} {result.peak_hour_kwh:.3f} kWh")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,14 @@
 """Devices as switches"""
 import logging
+import time
 
 from homeassistant.components.switch import SwitchDevice
-from homeassistant.const import (ATTR_ENTITY_ID, SERVICE_TURN_OFF,
-                                 SERVICE_TURN_ON, STATE_OFF, STATE_ON,
-                                 STATE_PROBLEM, STATE_UNAVAILABLE,
-                                 STATE_UNKNOWN)
-from homeassistant.exceptions import ServiceNotFound
+from homeassistant.const import (STATE_OFF, STATE_ON, STATE_PROBLEM,
+                                 STATE_UNAVAILABLE, STATE_UNKNOWN)
+from homeassistant.core import callback
 from homeassistant.helpers.config_validation import (PLATFORM_SCHEMA,
                                                      PLATFORM_SCHEMA_BASE)
+from homeassistant.helpers.event import async_track_state_change
 
 from .const import DOMAIN, POWER_ATTRS
 from .utils import get_entity_object
@@ -19,13 +19,31 @@ _LOGGER = logging.getLogger(__name__)
 async def async_setup_platform(
     hass, config, async_add_entities, discovery_info=None
 ):  # pylint: disable=unused-argument
-    pc = hass.data[DOMAIN]
-    devices = []
-    for dev in discovery_info:
-        devices.append(PowerDevice(hass, pc, dev))
+    pc = hass.data[DOMAIN][discovery_info["controller"]]
 
-    async_add_entities(devices, False)
-    pc.add_device(devices)
+    @callback
+    def async_update_devices(specs):
+        """Add, change and remove devices so they match specs."""
+        known = {device.turn_on_entity: device for device in pc.devices}
+        devices = []
+        for spec in specs:
+            device = known.pop(spec.turn_on, None)
+            if device is None:
+                devices.append(PowerDevice(hass, pc, spec))
+            elif device.spec != spec:
+                device.apply(spec)
+                pc.device_changed(device)
+
+        for device in known.values():
+            pc.remove_device(device)
+            hass.async_create_task(device.async_remove())
+
+        if devices:
+            pc.add_device(devices)
+            async_add_entities(devices, False)
+
+    pc.async_update_devices = async_update_devices
+    async_update_devices(discovery_info["devices"] or [])
 
 
 STATE_AS_ON = (STATE_ON,)
@@ -35,103 +53,122 @@ STATE_AS_OFF = (STATE_OFF,)
 class PowerDevice(SwitchDevice):
     """Represent a device that power controller can manage."""
 
-    def __init__(self, hass, pc, settings):
+    # Entity defines __eq__ but not __hash__, and the controller keeps the
+    # devices in dicts and sets.
+    __hash__ = object.__hash__
+
+    def __init__(self, hass, pc, spec):
         # Last action
         self.action = None
         self.hass = hass
         self.pc = pc
-        self.priority = settings.get("priority")
+        self.spec = None
+        self._power_usage_value = None
+        self._power_usage_attr = None
+        self._unsub_power_usage = None
+        self.apply(spec)
+
+    def apply(self, spec):
+        """Use the settings in spec, a schemas.DeviceSpec."""
+        old = self.spec
+        self.spec = spec
+        self.priority = spec.priority
         # Enitity to get the power usage
-        self.power_usage = settings.get("power_usage")
-        self.assumed_usage = settings.get("assumed_usage")
-        self.turn_on_entity = settings.get("turn_on")
-        self.turn_off_entity = settings.get("turn_off")
-        self._enabled = settings.get("enabled")
-        self._proxy_device_off = None
-        self._proxy_device_on = None
+        self.power_usage = spec.power_usage
+        self.assumed_usage = spec.assumed_usage
+        self.turn_on_entity = spec.turn_on
+        self.turn_off_entity = spec.turn_off or spec.turn_on
+        self.phases = spec.phases
+        self.run_hours = spec.run_hours
+        self.throttle = spec.throttle
+        if old is None or old.enabled != spec.enabled:
+            self._enabled = spec.enabled
+        if self._unsub_power_usage is not None and old.power_usage != spec.power_usage:
+            self._unsubscribe()
+            self._subscribe()
+
+    def _subscribe(self):
+        """Start following the entity we get the power usage from."""
+        entity_id = self.power_usage or self.turn_on_entity
+        self._update_power_usage(self.hass.states.get(entity_id))
+        self._push_power_usage()
+        self._unsub_power_usage = async_track_state_change(
+            self.hass, entity_id, self._async_power_usage_changed
+        )
 
-        if not self.turn_off_entity:
-            self.turn_off_entity = self.turn_on_entity
+    def _unsubscribe(self):
+        if self._unsub_power_usage is not None:
+            self._unsub_power_usage()
+            self._unsub_power_usage = None
 
-    def get_power_usage(self):
+    async def async_added_to_hass(self):
+        self._subscribe()
 
-        if self.power_usage is None:
-            for attr in POWER_ATTRS:
-                state = self.hass.states.get(self.turn_on)
+    async def async_will_remove_from_hass(self):
+        self._unsubscribe()
 
-                if state and state.attributes.get(attr) is not None:
-                    _LOGGER.debug(
-                        "Using attribute %s on %s to get the power usage",
-                        attr,
-                        self.turn_on,
-                    )
-                    return float(state.attributes.get(attr))
+    @callback
+    def _async_power_usage_changed(self, entity_id, old_state, new_state):
+        self._update_power_usage(new_state)
+        self._push_power_usage()
 
-            return float(self.assumed_usage)
+    def _update_power_usage(self, state):
+        """Parse the power usage from state so get_power_usage dont have to."""
+        self._power_usage_value = None
+        if state is None:
+            return
 
-        else:
+        if self.power_usage is not None:
             try:
-                return float(self.hass.states.get(self.power_usage))
-            except (AttributeError, TypeError):
+                self._power_usage_value = float(state.state)
+            except (TypeError, ValueError):
                 _LOGGER.debug(
                     "Failed to get the power usage from %s, using assumed usage",
                     self.power_usage,
                 )
-                return float(self.assumed_usage)
-
-    async def _turn(self, mode=False):
-        """Helper to turn off on on a device"""
-
-        # Some where we need to check if the device still has the same action as before
-        # We want a user to able to manually turning on/off the device
-        # and if thats done we should touch the device for some periode of time.
-        # Maybe we needed a grace periode for some kind, so we dont turn off the hotplate
-        # during dinner. :D
-
-        d = {"on": True, "off": False, "turn_off": False, "turn_on": True}
-
-        act = self.is_proxy_device_on()
-        if self.action is not None and d[self.action] is not act:
-            _LOGGER.info(
-                "Proxy device has changed status without power controller doing it (fx manually pressed the button, a automation or something), not doing anything."
-            )
             return
 
-        if mode is True:
-            m = SERVICE_TURN_ON
-            entity_id = self.turn_on_entity
-        else:
-            m = SERVICE_TURN_OFF
-            entity_id = self.turn_off_entity
-
-        domain = "homeassistant"
+        # Try the attribute that worked last time first.
+        attrs = POWER_ATTRS
+        if self._power_usage_attr is not None:
+            attrs = [self._power_usage_attr] + POWER_ATTRS
 
-        service_data = {ATTR_ENTITY_ID: entity_id} if entity_id else {}
+        for attr in attrs:
+            value = state.attributes.get(attr)
+            if value is None:
+                continue
+            try:
+                self._power_usage_value = float(value)
+            except (TypeError, ValueError):
+                continue
 
-        _LOGGER.info(
-            "tried to called with domain %s service %s %r", domain, m, service_data
-        )
-        try:
-            await self.hass.services.async_call(domain, m, service_data)
-        except ServiceNotFound:
-            _LOGGER.info("Maybe Service wasnt ready yet")
+            if attr != self._power_usage_attr:
+                _LOGGER.debug(
+                    "Using attribute %s on %s to get the power usage",
+                    attr,
+                    self.turn_on_entity,
+                )
+                self._power_usage_attr = attr
             return
 
-        self.action = m
+    def _push_power_usage(self):
+        """Keep the copy in the controllers table up to date."""
+        self.pc.table.set_power(self, self.get_power_usage())
+
+    def get_power_usage(self):
+        if self._power_usage_value is None:
+            return float(self.assumed_usage)
+        return self._power_usage_value
 
     def turn_on(self):
         """Turn on monitoring of this device"""
         self._enabled = True
+        self.pc.table.set_enabled(self, True)
 
     def turn_off(self):
         """Turn off monitoring of this device"""
         self._enabled = False
-
-    async def proxy_turn_off(self):
-        return await self._turn(False)
-
-    async def proxy_turn_on(self):
-        return await self._turn(True)
+        self.pc.table.set_enabled(self, False)
 
     def _proxy_ok(self, proxy):
         state = self.hass.states.get(proxy.entity_id)
@@ -148,34 +185,33 @@ class PowerDevice(SwitchDevice):
             return False
 
     def is_proxy_device_on(self):
-        if self._proxy_device_on is None:
-            found = get_entity_object(self.hass, self.turn_on_entity)
-            if found:
-                self._proxy_device_on = found
-
-        if self._proxy_device_on is not None:
-            return self._proxy_ok(self._proxy_device_on) is True
+        proxy = get_entity_object(self.hass, self.turn_on_entity)
+        if proxy is not None:
+            return self._proxy_ok(proxy) is True
         return False
 
     def is_proxy_device_off(self):
-        if self._proxy_device_off is None:
-            found = get_entity_object(self.hass, self.turn_off_entity)
-            if found:
-                self._proxy_device_off = found
-
-        if self._proxy_device_off is not None:
-            return self._proxy_ok(self._proxy_device_off) is False
+        proxy = get_entity_object(self.hass, self.turn_off_entity)
+        if proxy is not None:
+            return self._proxy_ok(proxy) is False
         return False
 
     @property
     def device_state_attributes(self):
         """Return the state attributes."""
-        return {
+        now = time.time()
+        state = self.pc.device_states[self]
+        attrs = {
             "priority": self.priority,
             "represent": self.turn_on_entity,
             "power_usage": self.get_power_usage(),
             "is_on": self.is_on,
+            "shed_state": state.state(now, self.pc.min_off_time, self.pc.min_on_time),
+            "service_calls_last_hour": state.service_calls_last_hour(now),
         }
+        if self.throttle:
+            attrs["setpoint"] = self.pc.throttler.setpoints.get(self)
+        return attrs
 
     @property
     def name(self):
@@ -0,0 +1,47 @@
+"""Struct of arrays view of the devices for the hot loops."""
+from array import array
+
+
+class DeviceTable:
+    """The per device fields the update reads, one array per field.
+
+    Rows are in the same order as PowerController.devices, lowest priority
+    first, so the priorities themselves aren't needed here. The entities
+    push their changes in, so the update reads plain numbers instead of
+    calling into every entity.
+
+    Only the power usage and the enabled flag are here. What we have shed
+    is in ShedDevices and the shed/restore timestamps are in the
+    DeviceStates, the restore pass only looks at the shed devices anyway.
+    """
+
+    __slots__ = ("devices", "rows", "power", "enabled")
+
+    def __init__(self):
+        self.devices = []
+        self.rows = {}
+        # Watts, the last power usage the device reported.
+        self.power = array("d")
+        self.enabled = array("b")
+
+    def rebuild(self, devices):
+        """Start over from devices, call when devices are added or removed."""
+        self.devices = list(devices)
+        self.rows = {device: row for row, device in enumerate(self.devices)}
+        self.power = array("d", [device.get_power_usage() for device in self.devices])
+        self.enabled = array(
+            "b", [device.is_on is not False for device in self.devices]
+        )
+
+    def set_power(self, device, power_usage):
+        row = self.rows.get(device)
+        if row is not None:
+            self.power[row] = power_usage
+
+    def set_enabled(self, device, enabled):
+        row = self.rows.get(device)
+        if row is not None:
+            self.enabled[row] = bool(enabled)
+
+    def __len__(self):
+        return len(self.devices)
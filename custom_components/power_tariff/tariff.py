@@ -0,0 +1,121 @@
+"""A tariff, compiled from the config once and never changed after."""
+import logging
+from collections import namedtuple
+from datetime import time
+
+import homeassistant.util.dt as dt_util
+from homeassistant.const import WEEKDAYS
+
+_LOGGER = logging.getLogger(__name__)
+
+# The default end time, means until midnight.
+END_OF_DAY = time(23, 59, 59)
+
+
+class Restrictions(
+    namedtuple(
+        "Restrictions",
+        ["date_start", "date_end", "time_start", "time_end", "weekdays"],
+    )
+):
+    """When a tariff is valid, the dates are the same every year."""
+
+    __slots__ = ()
+
+    @classmethod
+    def from_config(cls, conf):
+        return cls(
+            conf["date"]["start"],
+            conf["date"]["end"],
+            conf["time"]["start"],
+            conf["time"]["end"],
+            frozenset(conf["weekday"]),
+        )
+
+    def date_valid(self, date):
+        """If date is in the date range, a range can go over new year."""
+        today = (date.month, date.day)
+        if self.date_start <= self.date_end:
+            return self.date_start <= today <= self.date_end
+        return today >= self.date_start or today <= self.date_end
+
+    def time_valid(self, now):
+        """If the time now is in the time range.
+
+        An end of 23:59:59 includes the last second, so a tariff that lasts
+        the whole day doesnt have a hole before midnight.
+        """
+        if self.time_end == END_OF_DAY:
+            return self.time_start < now
+        return self.time_start < now < self.time_end
+
+
+class Tariff(
+    namedtuple(
+        "Tariff",
+        [
+            "name",
+            "enabled",
+            "priority",
+            "limit_kwh",
+            "over_limit_acceptance",
+            "over_limit_acceptance_seconds",
+            "restrictions",
+        ],
+    )
+):
+    __slots__ = ()
+
+    @classmethod
+    def from_config(cls, settings):
+        restrictions = settings.get("restrictions")
+        return cls(
+            settings.get("name"),
+            settings.get("enabled"),
+            settings.get("priority"),
+            settings.get("limit_kwh"),
+            settings.get("over_limit_acceptance"),
+            settings.get("over_limit_acceptance_seconds"),
+            Restrictions.from_config(restrictions) if restrictions else None,
+        )
+
+    def valid(self, now=None):
+        """validate if the tariff is valid (active)"""
+        if now is None:
+            now = dt_util.now()
+
+        restrictions = self.restrictions
+        if restrictions is None:
+            _LOGGER.debug("No restrictions are added, as result its always valid..")
+            return True
+
+        if not restrictions.date_valid(now.date()):
+            _LOGGER.debug(
+                "%s is not in valid date range start: %s end %s",
+                now.date(),
+                restrictions.date_start,
+                restrictions.date_end,
+            )
+            return False
+
+        if WEEKDAYS[now.weekday()] not in restrictions.weekdays:
+            _LOGGER.debug(
+                "today %s is not in %s", WEEKDAYS[now.weekday()], restrictions.weekdays
+            )
+            return False
+
+        if restrictions.time_valid(now.time()):
+            return True
+
+        _LOGGER.debug(
+            "%s  is not in valid time range start %s end %s",
+            now.time(),
+            restrictions.time_start,
+            restrictions.time_end,
+        )
+        return False
+
+    @property
+    def tariff_limit(self):
+        """ """
+        return self.limit_kwh * (1 + self.over_limit_acceptance)
@@ -0,0 +1,132 @@
+"""Turn adjustable devices down and up instead of off and on."""
+import logging
+import math
+from collections import namedtuple
+
+import homeassistant.helpers.config_validation as cv
+import voluptuous as vol
+
+_LOGGER = logging.getLogger(__name__)
+
+# min, max, step and deadband are in the unit of the setpoint entity, fx
+# amps for a charger.
+ThrottleSpec = namedtuple(
+    "ThrottleSpec", ["entity", "min", "max", "step", "watts_per_unit", "deadband"]
+)
+
+
+def throttle_spec(conf):
+    if conf["min"] >= conf["max"]:
+        raise vol.Invalid("min has to be less then max")
+    return ThrottleSpec(
+        conf["entity"],
+        conf["min"],
+        conf["max"],
+        conf["step"],
+        conf["watts_per_unit"],
+        conf.get("deadband", conf["step"]),
+    )
+
+
+THROTTLE_SCHEMA = vol.All(
+    {
+        vol.Required("entity"): cv.entity_id,
+        vol.Required("min"): vol.Coerce(float),
+        vol.Required("max"): vol.Coerce(float),
+        vol.Optional("step", default=1.0): vol.All(
+            vol.Coerce(float), vol.Range(min=0, min_included=False)
+        ),
+        vol.Required("watts_per_unit"): vol.All(
+            vol.Coerce(float), vol.Range(min=0, min_included=False)
+        ),
+        # Changes smaller then this are not sent, defaults to step.
+        vol.Optional("deadband"): vol.All(vol.Coerce(float), vol.Range(min=0)),
+    },
+    throttle_spec,
+)
+
+
+def water_fill(items, budget):
+    """Share budget between items of (low, high, weight).
+
+    Every item gets level * weight, kept between its low and high, with the
+    level picked so it all adds up to budget. Sorting the points where the
+    items hit their low and high makes this O(n log n).
+    """
+    lows = sum(low for low, _, _ in items)
+    if budget <= lows:
+        return [low for low, _, _ in items]
+    if budget >= sum(high for _, high, _ in items):
+        return [high for _, high, _ in items]
+
+    points = []
+    for low, high, weight in items:
+        points.append((low / weight, weight))
+        points.append((high / weight, -weight))
+    points.sort()
+
+    total = lows
+    level = 0.0
+    slope = 0.0
+    for point, weight in points:
+        reached = total + slope * (point - level)
+        if reached >= budget:
+            break
+        total = reached
+        level = point
+        slope += weight
+
+    level += (budget - total) / slope
+    return [min(max(level * weight, low), high) for low, high, weight in items]
+
+
+def quantize(spec, value):
+    """Round value down to a step, between min and max."""
+    steps = math.floor((value - spec.min) / spec.step + 1e-9)
+    return min(max(spec.min + steps * spec.step, spec.min), spec.max)
+
+
+class Throttler:
+    """Spreads the headroom over the devices with a setpoint.
+
+    Higher priority devices get a larger share. Remembers the setpoints we
+    have sent so we only send the ones that moved more then the deadband.
+    """
+
+    def __init__(self):
+        self.setpoints = {}
+
+    def plan(self, devices, headroom, current):
+        """Returns (device, setpoint, watts) for the devices that should move.
+
+        watts is how much more the device will use. headroom is the watts we
+        may add, negative if we have to get rid of some. current(device) is
+        the setpoint the device has now.
+        """
+        now = [current(device) for device in devices]
+        used = sum(
+            value * device.throttle.watts_per_unit
+            for device, value in zip(devices, now)
+        )
+        targets = water_fill(
+            [
+                (
+                    device.throttle.min * device.throttle.watts_per_unit,
+                    device.throttle.max * device.throttle.watts_per_unit,
+                    device.priority,
+                )
+                for device in devices
+            ],
+            used + headroom,
+        )
+
+        changes = []
+        for device, value, target in zip(devices, now, targets):
+            spec = device.throttle
+            new = quantize(spec, target / spec.watts_per_unit)
+            if new == value:
+                continue
+            if abs(new - value) < spec.deadband and new not in (spec.min, spec.max):
+                continue
+            changes.append((device, new, (new - value) * spec.watts_per_unit))
+        return changes
@@ -0,0 +1,166 @@
+"""Sweep tariff settings over recorded meter readings.
+
+    python -m custom_components.power_tariff.tune meter.csv --limit-kwh 3000 3500
+
+For every combination of limit_kwh, over_limit_acceptance and
+over_limit_acceptance_seconds this prints how many times we would start
+shedding, how much energy we would have to shed and the worst hour after
+shedding. It needs numpy.
+
+When we shed follows should_reduce_power, but it assumes shedding brings
+us back to the limit until the reading drops under it, so the energy is an
+estimate. Use simulate for the exact behaviour of a single config.
+"""
+import argparse
+import csv
+import itertools
+import sys
+
+from .simulate import read_csv, read_parquet
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+FIELDS = [
+    "limit_kwh",
+    "over_limit_acceptance",
+    "over_limit_acceptance_seconds",
+    "events",
+    "curtailed_kwh",
+    "worst_hour_kwh",
+]
+
+
+def load(samples):
+    """Read (timestamp, watts) samples into two numpy arrays."""
+    if np is None:
+        raise RuntimeError("Tuning requires numpy")
+
+    data = np.fromiter(itertools.chain.from_iterable(samples), dtype=float)
+    data = data.reshape(-1, 2)
+    return data[:, 0], data[:, 1]
+
+
+class _Meter:
+    """The parts of the sweep that dont depend on the settings."""
+
+    def __init__(self, times, power):
+        self.times = times
+        self.power = power
+        # How long each reading is valid.
+        self.dt = np.diff(times, append=times[-1])
+        self.hours = ((times - times[0] + times[0] % 3600) // 3600).astype(np.int64)
+        self.hour_wh = np.bincount(self.hours, weights=power * self.dt) / 3600
+
+    def sweep_threshold(self, threshold, seconds):
+        """events, curtailed Wh and worst hour Wh for each value in seconds."""
+        excess = self.power - threshold
+        idx = np.flatnonzero(excess > 0)
+        if not idx.size:
+            zeros = np.zeros(seconds.size)
+            return zeros, zeros, np.full(seconds.size, self.hour_wh.max())
+
+        # Split the readings over the limit into runs of consecutive readings.
+        breaks = np.flatnonzero(np.diff(idx) != 1) + 1
+        run = np.zeros(idx.size, dtype=np.int64)
+        run[breaks] = 1
+        run = np.cumsum(run)
+
+        over_times = self.times[idx]
+        wh = excess[idx] * self.dt[idx] / 3600
+        hours = self.hours[idx]
+        positions = np.arange(idx.size)
+
+        events = np.empty(seconds.size)
+        curtailed = np.empty(seconds.size)
+        worst = np.empty(seconds.size)
+        for pos, limit_seconds in enumerate(seconds):
+            shed_at = _shed_positions(over_times, limit_seconds)
+            events[pos] = shed_at.size
+            # Everything over the limit after we shed in a run has to be shed.
+            first_shed = np.full(run[-1] + 1, idx.size)
+            np.minimum.at(first_shed, run[shed_at], shed_at)
+            mask = positions >= first_shed[run]
+            curtailed[pos] = wh[mask].sum()
+            shed = np.bincount(
+                hours[mask], weights=wh[mask], minlength=self.hour_wh.size
+            )
+            worst[pos] = (self.hour_wh - shed).max()
+
+        return events, curtailed, worst
+
+
+def _shed_positions(over_times, seconds):
+    """Where in over_times should_reduce_power would say we should shed.
+
+    Like the controller we remember the first reading over the limit until
+    we shed, also when the readings in between are under it, and shed on
+    the first reading more then seconds after it.
+    """
+    if seconds <= 0:
+        return np.arange(over_times.size)
+
+    positions = []
+    first = 0
+    while first < over_times.size:
+        pos = int(np.searchsorted(over_times, over_times[first] + seconds, "right"))
+        if pos >= over_times.size:
+            break
+        positions.append(pos)
+        first = pos + 1
+    return np.array(positions, dtype=np.int64)
+
+
+def sweep(times, power, limits, acceptances, seconds):
+    """Evaluate every combination, returns a list of dicts with FIELDS."""
+    if np is None:
+        raise RuntimeError("Tuning requires numpy")
+
+    meter = _Meter(np.asarray(times, float), np.asarray(power, float))
+    seconds = np.asarray(seconds, dtype=float)
+    cache = {}
+    rows = []
+    for limit_kwh in limits:
+        for acceptance in acceptances:
+            threshold = limit_kwh * (1 + acceptance)
+            if threshold not in cache:
+                cache[threshold] = meter.sweep_threshold(threshold, seconds)
+            events, curtailed, worst = cache[threshold]
+            for pos, limit_seconds in enumerate(seconds):
+                rows.append(
+                    {
+                        "limit_kwh": limit_kwh,
+                        "over_limit_acceptance": acceptance,
+                        "over_limit_acceptance_seconds": float(limit_seconds),
+                        "events": int(events[pos]),
+                        "curtailed_kwh": float(curtailed[pos]) / 1000,
+                        "worst_hour_kwh": float(worst[pos]) / 1000,
+                    }
+                )
+
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("meter", help="csv or parquet file with the meter readings")
+    parser.add_argument("--timestamp-column", default="timestamp")
+    parser.add_argument("--value-column", default="value")
+    parser.add_argument("--limit-kwh", type=int, nargs="+", required=True)
+    parser.add_argument("--acceptance", type=float, nargs="+", default=[0.0])
+    parser.add_argument("--seconds", type=float, nargs="+", default=[60.0])
+    args = parser.parse_args(argv)
+
+    reader = read_parquet if args.meter.endswith(".parquet") else read_csv
+    times, power = load(reader(args.meter, args.timestamp_column, args.value_column))
+    rows = sweep(times, power, args.limit_kwh, args.acceptance, args.seconds)
+
+    writer = csv.DictWriter(sys.stdout, FIELDS)
+    writer.writeheader()
+    writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    main()
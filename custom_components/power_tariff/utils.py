@@ -1,17 +1,89 @@
 import logging
 
+from homeassistant.const import EVENT_STATE_CHANGED
+from homeassistant.core import callback
+
+from .const import DATA_ENTITY_INDEX
+
 _LOGGER = logging.getLogger(__name__)
 
 
+class EntityIndex:
+    """entity_id -> entity object, shared by everything in this integration.
+
+    A domain is scanned the first time we ask for one of its entities, after
+    that lookups are a dict get. Misses are remembered too, and forgotten
+    again when the entity shows up in the state machine.
+    """
+
+    def __init__(self, hass):
+        self.hass = hass
+        self._entities = {}
+        self._missing = set()
+        self._indexed = set()
+        self._unsub = None
+
+    @callback
+    def async_start(self):
+        self._unsub = self.hass.bus.async_listen(
+            EVENT_STATE_CHANGED, self._async_state_changed
+        )
+
+    @callback
+    def async_stop(self):
+        if self._unsub is not None:
+            self._unsub()
+            self._unsub = None
+
+    @callback
+    def _async_state_changed(self, event):
+        old_state = event.data.get("old_state")
+        new_state = event.data.get("new_state")
+        if old_state is not None and new_state is not None:
+            return
+
+        entity_id = event.data.get("entity_id")
+        if new_state is None:
+            _LOGGER.debug("%s was removed", entity_id)
+            self._entities.pop(entity_id, None)
+        else:
+            # Rescan the domain next time we need it.
+            self._missing.discard(entity_id)
+            self._indexed.discard(entity_id.split(".")[0])
+
+    def _index_domain(self, domain):
+        try:
+            component = self.hass.data[domain]
+            for ent in component.entities:
+                self._entities[ent.entity_id] = ent
+        except Exception:  # pylint: disable=broad-except
+            _LOGGER.exception("Failed to index the entities in %s", domain)
+            return
+
+        self._indexed.add(domain)
+
+    def get(self, entity_id):
+        ent = self._entities.get(entity_id)
+        if ent is not None or entity_id in self._missing:
+            return ent
+
+        domain = entity_id.split(".")[0]
+        if domain not in self._indexed:
+            self._index_domain(domain)
+            ent = self._entities.get(entity_id)
+
+        if ent is None:
+            self._missing.add(entity_id)
+        else:
+            _LOGGER.debug("Found it, %r", ent)
+        return ent
+
+
 def get_entity_object(hass, entity_id):
     """you are not allowed to interact directly with entity objects 🤷"""
-    domain = entity_id.split('.')[0]
-    try:
-        for ent in hass.data[domain].entities:
-            if ent.entity_id == entity_id:
-                _LOGGER.debug("Found it, %r", ent)
-                return ent
-    except Exception as e:
-        _LOGGER.exception("Failed to get the entity using %s", entity_id)
-
-    return None
+    index = hass.data.get(DATA_ENTITY_INDEX)
+    if index is None:
+        index = hass.data[DATA_ENTITY_INDEX] = EntityIndex(hass)
+        index.async_start()
+
+    return index.get(entity_id)
@@ -1,26 +1,46 @@
 """Helpers for validate the config."""
 
 import datetime as dt
+from collections import namedtuple
 
 import voluptuous as vol
 
 DATE_STR_FORMAT = "%d.%m"
 
+# A day of the year that comes back every year, compares like a (month, day) tuple.
+RecurringDate = namedtuple("RecurringDate", ["month", "day"])
+
 
 def parse_to_date(dt_str):
-    """Convert a date string to a date object with with this year."""
-    now = dt.datetime.now()
+    """Convert a day.month string to a RecurringDate."""
     try:
-        return (
-            dt.datetime.strptime(dt_str, DATE_STR_FORMAT).date().replace(year=now.year)
-        )
+        day, month = (int(part) for part in str(dt_str).split("."))
+        # A leap year so 29.02 is allowed.
+        dt.date(2000, month, day)
     except ValueError:  # If dt_str did not match our format
         return None
+    return RecurringDate(month, day)
 
 
 def validate_date(dt_str):
     date = parse_to_date(dt_str)
     if date is None:
-        vol.Invalid("Failed to parse %s to date, expected format is day.month (01.12")
+        raise vol.Invalid(
+            f"Failed to parse {dt_str} to date, expected format is day.month (01.12)"
+        )
 
     return date
+
+
+def unique_names(configs):
+    """More then one controller needs a name on each, and no two the same."""
+    if len(configs) < 2:
+        return configs
+
+    names = [conf.get("name") for conf in configs]
+    if None in names:
+        raise vol.Invalid("Every controller needs a name when there is more then one")
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise vol.Invalid(f"Controller names must be unique, got {duplicates} twice")
+    return configs
@@ -0,0 +1,38 @@
+"""The http api, the decisions and the metrics of every controller."""
+from aiohttp import web
+from homeassistant.components.http import HomeAssistantView
+
+from . import _decisions
+from .const import DOMAIN
+from .metrics import exposition
+
+
+class DecisionsView(HomeAssistantView):
+    """Download the last decisions of every controller as json."""
+
+    url = f"/api/{DOMAIN}/decisions"
+    name = f"api:{DOMAIN}:decisions"
+
+    async def get(self, request):
+        return self.json(_decisions(request.app["hass"].data[DOMAIN]))
+
+
+class MetricsView(HomeAssistantView):
+    """Serve the metrics in the prometheus text format."""
+
+    url = f"/api/{DOMAIN}/metrics"
+    name = f"api:{DOMAIN}:metrics"
+
+    async def get(self, request):
+        controllers = request.app["hass"].data[DOMAIN]
+        text = exposition(
+            [
+                (
+                    f'controller="{pc.name}"' if pc.name else "",
+                    pc.metrics,
+                    pc.device_states,
+                )
+                for pc in controllers
+            ]
+        )
+        return web.Response(text=text, content_type="text/plain")
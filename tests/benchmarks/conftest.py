@@ -0,0 +1,87 @@
+"""Controllers under synthetic load for the benchmarks."""
+import asyncio
+
+import pytest
+
+from custom_components.power_tariff import CONFIG_SCHEMA, PowerController
+from custom_components.power_tariff.const import DOMAIN
+from custom_components.power_tariff.meter import CycleMeter
+from custom_components.power_tariff.switch import PowerDevice
+
+from .fake_hass import FakeHass
+
+DEVICE_COUNTS = [10, 100, 1000]
+TARIFF_COUNTS = [1, 10, 50]
+LIMIT = 3000
+
+
+def raw_config(devices, tariffs, **settings):
+    """A controller config with devices and tariffs, like in configuration.yaml.
+
+    All but the last tariff are only valid for an hour on some days, the
+    last one is always valid.
+    """
+    raw = [
+        {
+            "name": f"tariff_{idx}",
+            "limit_kwh": LIMIT,
+            "over_limit_acceptance_seconds": 0.0,
+            "restrictions": {
+                "time": {
+                    "start": f"{idx % 23:02d}:00:00",
+                    "end": f"{idx % 23 + 1:02d}:00:00",
+                },
+                "weekday": ["mon", "wed", "fri"] if idx % 2 else ["tue", "thu"],
+            },
+        }
+        for idx in range(tariffs - 1)
+    ]
+    raw.append(
+        {"name": "base", "limit_kwh": LIMIT, "over_limit_acceptance_seconds": 0.0}
+    )
+    conf = {
+        "monitor_entity": "sensor.power",
+        "tariffs": raw,
+        "devices": [
+            {
+                "turn_on": f"switch.device_{idx}",
+                "assumed_usage": float(100 + idx * 37 % 900),
+                "priority": 1 + idx % 100,
+            }
+            for idx in range(devices)
+        ],
+    }
+    conf.update(settings)
+    return conf
+
+
+def make_config(devices, tariffs, **settings):
+    """raw_config, validated."""
+    return CONFIG_SCHEMA({DOMAIN: raw_config(devices, tariffs, **settings)})[DOMAIN][0]
+
+
+def make_controller(hass, conf, readings=None):
+    """A ready controller with a PowerDevice for every device in conf."""
+    pc = PowerController(hass, conf, meter=CycleMeter(readings))
+    pc.add_tariff(list(conf["tariffs"]))
+    devices = []
+    for spec in conf["devices"]:
+        hass.add_switch(spec.turn_on)
+        devices.append(PowerDevice(hass, pc, spec))
+    pc.add_device(devices)
+    pc.ready = True
+    return pc
+
+
+@pytest.fixture
+def hass():
+    return FakeHass()
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    asyncio.set_event_loop(None)
+    loop.close()
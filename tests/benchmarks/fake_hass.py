@@ -0,0 +1,125 @@
+"""Just enough of hass to run the power controller without Home Assistant.
+
+The state machine is a dict, the service registry flips the switches and
+updates their states, and the switch component is a list of entities.
+"""
+import asyncio
+import os
+from collections import namedtuple
+
+from homeassistant.const import (ATTR_ENTITY_ID, SERVICE_TURN_OFF,
+                                 SERVICE_TURN_ON, STATE_OFF, STATE_ON)
+
+State = namedtuple("State", ["entity_id", "state", "attributes"])
+
+
+class FakeStates:
+    def __init__(self):
+        self._states = {}
+
+    def get(self, entity_id):
+        return self._states.get(entity_id)
+
+    def async_set(self, entity_id, state, attributes=None):
+        self._states[entity_id] = State(entity_id, str(state), attributes or {})
+
+
+class FakeServices:
+    def __init__(self, hass):
+        self.hass = hass
+        self.calls = 0
+        # (service, entity_ids) of the turn on and off calls, in order.
+        self.log = []
+        self.registered = {}
+
+    def async_register(self, domain, service, service_func, schema=None):
+        self.registered[(domain, service)] = service_func
+
+    async def async_call(self, domain, service, service_data, blocking=False):
+        self.calls += 1
+        entity_ids = service_data[ATTR_ENTITY_ID]
+        if isinstance(entity_ids, str):
+            entity_ids = [entity_ids]
+        if service not in (SERVICE_TURN_ON, SERVICE_TURN_OFF):
+            return
+        self.log.append((service, tuple(entity_ids)))
+        for entity_id in entity_ids:
+            switch = self.hass.switches.get(entity_id)
+            if switch is not None:
+                switch.is_on = service == SERVICE_TURN_ON
+                self.hass.states.async_set(
+                    entity_id, STATE_ON if switch.is_on else STATE_OFF
+                )
+
+
+class FakeBus:
+    def __init__(self):
+        self.listeners = {}
+
+    def async_listen(self, event_type, listener):
+        listeners = self.listeners.setdefault(event_type, [])
+        listeners.append(listener)
+        return lambda: listeners.remove(listener)
+
+    def async_listen_once(self, event_type, listener):
+        return self.async_listen(event_type, listener)
+
+
+class FakeHttp:
+    def __init__(self):
+        self.views = []
+
+    def register_view(self, view):
+        self.views.append(view)
+
+
+class FakeConfig:
+    config_dir = "/config"
+
+    def path(self, *path):
+        return os.path.join(self.config_dir, *path)
+
+
+class FakeSwitch:
+    """The entity object of a switch we control."""
+
+    def __init__(self, entity_id, is_on=True):
+        self.entity_id = entity_id
+        self.is_on = is_on
+
+
+class FakeComponent:
+    def __init__(self):
+        self.entities = []
+
+
+class FakeHass:
+    def __init__(self):
+        self.data = {}
+        self.states = FakeStates()
+        self.services = FakeServices(self)
+        self.bus = FakeBus()
+        self.http = FakeHttp()
+        self.config = FakeConfig()
+        self.switches = {}
+        self.data["switch"] = FakeComponent()
+
+    def add_switch(self, entity_id, is_on=True):
+        switch = FakeSwitch(entity_id, is_on)
+        self.switches[entity_id] = switch
+        self.data["switch"].entities.append(switch)
+        self.states.async_set(entity_id, STATE_ON if is_on else STATE_OFF)
+        return switch
+
+    @property
+    def loop(self):
+        return asyncio.get_event_loop()
+
+    def async_add_executor_job(self, target, *args):
+        future = self.loop.create_future()
+        future.set_result(target(*args))
+        return future
+
+    def async_create_task(self, coro):
+        # Nothing runs in the background here.
+        coro.close()
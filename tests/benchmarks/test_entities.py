@@ -0,0 +1,68 @@
+"""Looking up the entity objects of the switches we control."""
+import itertools
+from collections import namedtuple
+
+import pytest
+
+from custom_components.power_tariff.utils import EntityIndex, get_entity_object
+
+from .conftest import DEVICE_COUNTS
+
+Event = namedtuple("Event", ["data"])
+
+
+def add_switches(hass, count):
+    for idx in range(count):
+        hass.add_switch(f"switch.device_{idx}")
+
+
+@pytest.mark.parametrize("entities", DEVICE_COUNTS)
+def test_get_entity_object(benchmark, hass, entities):
+    add_switches(hass, entities)
+    # The last one, the worst case for a scan.
+    entity_id = f"switch.device_{entities - 1}"
+    assert benchmark(get_entity_object, hass, entity_id) is not None
+
+
+@pytest.mark.parametrize("entities", DEVICE_COUNTS)
+def test_get_entity_object_missing(benchmark, hass, entities):
+    add_switches(hass, entities)
+    assert benchmark(get_entity_object, hass, "switch.missing") is None
+
+
+def scan(hass, entity_id):
+    """What get_entity_object did before the index."""
+    domain = entity_id.split(".")[0]
+    for ent in hass.data[domain].entities:
+        if ent.entity_id == entity_id:
+            return ent
+    return None
+
+
+@pytest.mark.parametrize("entities", [1000, 10000])
+@pytest.mark.parametrize("lookup", [scan, get_entity_object], ids=["scan", "index"])
+@pytest.mark.parametrize("found", [True, False], ids=["hit", "miss"])
+def test_lookup(benchmark, hass, lookup, entities, found):
+    add_switches(hass, entities)
+    # The middle one, the average for a scan.
+    entity_id = f"switch.device_{entities // 2}" if found else "switch.missing"
+    assert (benchmark(lookup, hass, entity_id) is not None) is found
+
+
+@pytest.mark.parametrize("entities", [1000, 10000])
+def test_index_after_add(benchmark, hass, entities):
+    # Looking up an entity that was just added rescans its domain once.
+    add_switches(hass, entities)
+    index = EntityIndex(hass)
+    index.get("switch.device_0")
+    added = itertools.count()
+
+    def add():
+        entity_id = f"switch.new_{next(added)}"
+        hass.add_switch(entity_id)
+        index._async_state_changed(
+            Event({"entity_id": entity_id, "old_state": None, "new_state": "on"})
+        )
+        return (entity_id,), {}
+
+    assert benchmark.pedantic(index.get, setup=add, rounds=200) is not None
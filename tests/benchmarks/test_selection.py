@@ -0,0 +1,65 @@
+"""Picking the devices to turn off."""
+import pytest
+
+from custom_components.power_tariff.decision import decide
+from custom_components.power_tariff.selection import STRATEGIES
+
+from .conftest import DEVICE_COUNTS, LIMIT, make_config, make_controller
+
+START = 1700000000
+
+
+class Candidate:
+    def __init__(self, spec):
+        self.device = spec
+        self.priority = spec.priority
+
+
+def make_candidates(count):
+    specs = sorted(make_config(count, 1)["devices"], key=lambda spec: spec.priority)
+    return [(Candidate(spec), spec.assumed_usage) for spec in specs]
+
+
+@pytest.mark.parametrize("devices", DEVICE_COUNTS)
+@pytest.mark.parametrize("strategy", sorted(STRATEGIES))
+def test_select(benchmark, strategy, devices):
+    candidates = make_candidates(devices)
+    # Around a fifth of what the devices use.
+    excess = sum(power for _, power in candidates) / 5
+    picked = benchmark(STRATEGIES[strategy], candidates, excess, 0.05)
+    picked = set(picked)
+    covered = sum(power for candidate, power in candidates if candidate in picked)
+    assert covered >= excess
+
+
+def shed_kwh(pc, excesses):
+    """kWh turned off for an hour with a decision every 5 minutes."""
+    wh = 0.0
+    for idx, excess in enumerate(excesses):
+        snapshot = pc.take_snapshot(START + idx * 300, LIMIT + excess)
+        powers = {dev.device: dev.power_usage for dev in snapshot.devices}
+        plan = decide(snapshot, pc.select_devices, pc.select_time_budget)
+        wh += sum(powers[device] for device, _, _ in plan.steps) * 300 / 3600
+    return wh / 1000
+
+
+@pytest.mark.parametrize("devices", [10, 50, 100, 250, 500])
+@pytest.mark.parametrize("strategy", sorted(STRATEGIES))
+def test_decide(benchmark, hass, strategy, devices):
+    """Decision latency, and the kWh shed compared to greedy."""
+    conf = make_config(devices, 1, strategy=strategy)
+    pc = make_controller(hass, conf)
+    pc.check_tariff(START)
+    # Between a small device and a good part of everything.
+    total = sum(spec.assumed_usage for spec in conf["devices"])
+    excesses = [150 + total * (idx % 6) / 15 for idx in range(12)]
+
+    snapshot = pc.take_snapshot(START, LIMIT + excesses[3])
+    plan = benchmark(decide, snapshot, pc.select_devices, pc.select_time_budget)
+    assert plan.steps
+
+    greedy_pc = make_controller(hass, make_config(devices, 1))
+    greedy_pc.check_tariff(START)
+    kwh = shed_kwh(pc, excesses)
+    benchmark.extra_info["kwh_shed"] = round(kwh, 3)
+    benchmark.extra_info["kwh_saved"] = round(shed_kwh(greedy_pc, excesses) - kwh, 3)
@@ -0,0 +1,19 @@
+"""Setting up the integration from configuration.yaml."""
+import pytest
+
+from custom_components.power_tariff import CONFIG_SCHEMA, async_setup
+from custom_components.power_tariff.const import DOMAIN
+
+from .conftest import DEVICE_COUNTS, raw_config
+from .fake_hass import FakeHass
+
+
+@pytest.mark.parametrize("tariffs", [1, 50])
+@pytest.mark.parametrize("devices", DEVICE_COUNTS)
+def test_async_setup(benchmark, loop, devices, tariffs):
+    config = CONFIG_SCHEMA({DOMAIN: raw_config(devices, tariffs)})
+
+    def setup():
+        assert loop.run_until_complete(async_setup(FakeHass(), config))
+
+    benchmark(setup)
@@ -0,0 +1,59 @@
+"""Working out which tariff is active."""
+import itertools
+
+import homeassistant.util.dt as dt_util
+import pytest
+
+from custom_components.power_tariff.schedule import TariffSchedule, pick_tariff
+
+from .conftest import TARIFF_COUNTS, make_config
+
+START = 1700000000
+WHEN = dt_util.as_local(dt_util.utc_from_timestamp(START))
+
+
+@pytest.mark.parametrize("restricted", [True, False], ids=["restricted", "always"])
+def test_tariff_valid(benchmark, restricted):
+    tariffs = make_config(0, 2)["tariffs"]
+    tariff = tariffs[0] if restricted else tariffs[1]
+    benchmark(tariff.valid, WHEN)
+
+
+def test_tariff_valid_now(benchmark):
+    # Without now it reads the clock, like every update used to.
+    tariff = make_config(0, 2)["tariffs"][0]
+    benchmark(tariff.valid)
+
+
+def scan(tariffs, timestamp):
+    """What check_tariff did before the schedule."""
+    return pick_tariff(tariffs, dt_util.as_local(dt_util.utc_from_timestamp(timestamp)))
+
+
+@pytest.mark.parametrize("tariffs", TARIFF_COUNTS)
+def test_linear_scan(benchmark, tariffs):
+    tariffs = make_config(0, tariffs)["tariffs"]
+    clock = itertools.count(START)
+    benchmark(lambda: scan(tariffs, next(clock)))
+
+
+@pytest.mark.parametrize("tariffs", TARIFF_COUNTS)
+def test_schedule_lookup(benchmark, tariffs):
+    # A sample every second, most of them hit the cached tariff.
+    tariffs = make_config(0, tariffs)["tariffs"]
+    schedule = TariffSchedule(tariffs)
+    clock = itertools.count(START)
+    benchmark(lambda: schedule.lookup(next(clock)))
+
+
+@pytest.mark.parametrize("tariffs", TARIFF_COUNTS)
+def test_schedule_bisect(benchmark, tariffs):
+    # Every lookup is in another segment, so it has to bisect.
+    tariffs = make_config(0, tariffs)["tariffs"]
+    schedule = TariffSchedule(tariffs)
+    schedule.build(WHEN)
+    timestamps = range(START, START + 5 * 86400, 1799)
+    for timestamp in timestamps[:100]:
+        assert schedule.lookup(timestamp) is scan(tariffs, timestamp)
+    clock = itertools.cycle(timestamps)
+    benchmark(lambda: schedule.lookup(next(clock)))
@@ -0,0 +1,30 @@
+"""PowerController.update() with the meter going over and under the limit."""
+import itertools
+
+import pytest
+
+from .conftest import DEVICE_COUNTS, LIMIT, TARIFF_COUNTS, make_config, make_controller
+
+# Over the limit, then room to turn most of it on again.
+READINGS = [LIMIT + 1500, LIMIT - 2000]
+# Starting the event loop costs more then an update, so every round runs a few.
+UPDATES_PER_ROUND = 20
+
+
+@pytest.mark.parametrize("tariffs", TARIFF_COUNTS)
+@pytest.mark.parametrize("devices", DEVICE_COUNTS)
+def test_update(benchmark, hass, loop, devices, tariffs):
+    pc = make_controller(hass, make_config(devices, tariffs), READINGS)
+    clock = itertools.count(1700000000)
+
+    async def updates():
+        for _ in range(UPDATES_PER_ROUND):
+            timestamp = next(clock)
+            pc.check_tariff(timestamp)
+            await pc.update(timestamp=timestamp)
+
+    benchmark(lambda: loop.run_until_complete(updates()))
+    benchmark.extra_info["updates_per_round"] = UPDATES_PER_ROUND
+    benchmark.extra_info["service_calls"] = hass.services.calls
+    # Every reading over the limit should have turned something off.
+    assert pc.metrics.service_calls > 0
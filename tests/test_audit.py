@@ -0,0 +1,65 @@
+"""The audit file, written in batches and when Home Assistant stops."""
+import asyncio
+import json
+
+import pytest
+from homeassistant.const import EVENT_HOMEASSISTANT_STOP
+
+from custom_components.power_tariff import CONFIG_SCHEMA, async_setup
+from custom_components.power_tariff.const import DOMAIN
+from custom_components.power_tariff.switch import PowerDevice
+
+from .benchmarks.conftest import raw_config
+from .benchmarks.fake_hass import FakeHass
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    asyncio.set_event_loop(None)
+    loop.close()
+
+
+def setup(loop, tmp_path, audit_file):
+    hass = FakeHass()
+    hass.config.config_dir = str(tmp_path)
+    config = CONFIG_SCHEMA({DOMAIN: raw_config(2, 1, audit_file=audit_file)})
+    loop.run_until_complete(async_setup(hass, config))
+    return hass, hass.data[DOMAIN][0]
+
+
+def test_audit_file_in_config_dir(loop, tmp_path):
+    _, pc = setup(loop, tmp_path, "audit.log")
+
+    assert pc.audit.path == str(tmp_path / "audit.log")
+
+
+def test_absolute_audit_file(loop, tmp_path):
+    path = str(tmp_path / "elsewhere.log")
+    _, pc = setup(loop, tmp_path, path)
+
+    assert pc.audit.path == path
+
+
+def test_pending_written_on_stop(loop, tmp_path):
+    hass, pc = setup(loop, tmp_path, "audit.log")
+    for spec in pc.settings["devices"]:
+        hass.add_switch(spec.turn_on)
+        pc.add_device(PowerDevice(hass, pc, spec))
+    pc.ready = True
+    timestamp = 1700002800.0
+    for _ in range(3):
+        loop.run_until_complete(pc.update(5000.0, timestamp))
+        timestamp += 10
+    # Less then a batch, so nothing is written yet.
+    assert pc.audit.records
+    assert not (tmp_path / "audit.log").exists()
+
+    for listener in hass.bus.listeners[EVENT_HOMEASSISTANT_STOP]:
+        loop.run_until_complete(listener(None))
+
+    lines = (tmp_path / "audit.log").read_text().splitlines()
+    assert len(lines) == len(pc.audit.records)
+    assert json.loads(lines[-1])["usage"] == 5000.0
@@ -0,0 +1,116 @@
+"""Single-flight updates, merged while one is running."""
+import asyncio
+import time
+
+import pytest
+from homeassistant.core import HomeAssistant
+
+from custom_components.power_tariff.coalesce import UpdateCoalescer
+
+
+@pytest.fixture
+def hass():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield HomeAssistant(loop)
+    asyncio.set_event_loop(None)
+    loop.close()
+
+
+class Action:
+    """Counts the runs and how many ran at the same time."""
+
+    def __init__(self):
+        self.runs = []
+        self.running = 0
+        self.most_running = 0
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def __call__(self):
+        self.running += 1
+        self.most_running = max(self.most_running, self.running)
+        self.runs.append(time.monotonic())
+        await self.release.wait()
+        self.running -= 1
+
+
+def run(hass):
+    hass.loop.run_until_complete(hass.async_block_till_done())
+
+
+def test_requests_are_merged(hass):
+    action = Action()
+    coalescer = UpdateCoalescer(hass, action)
+
+    for _ in range(5):
+        coalescer.async_request()
+    run(hass)
+
+    assert len(action.runs) == 1
+    metrics = coalescer.metrics
+    assert (metrics.samples_received, metrics.samples_coalesced) == (5, 4)
+    assert metrics.samples_processed == 1
+
+
+def test_one_update_at_the_time(hass):
+    action = Action()
+    action.release.clear()
+    coalescer = UpdateCoalescer(hass, action)
+
+    async def requests():
+        coalescer.async_request()
+        await asyncio.sleep(0.01)
+        # The first one is running now, these are merged into one more.
+        for _ in range(3):
+            coalescer.async_request()
+        await asyncio.sleep(0.01)
+        action.release.set()
+
+    hass.loop.run_until_complete(requests())
+    run(hass)
+
+    assert len(action.runs) == 2
+    assert action.most_running == 1
+    assert coalescer.metrics.samples_coalesced == 2
+
+
+def test_min_interval(hass):
+    action = Action()
+    coalescer = UpdateCoalescer(hass, action, min_interval=0.1, max_staleness=5)
+
+    coalescer.async_request()
+    run(hass)
+    coalescer.async_request()
+    run(hass)
+
+    assert action.runs[1] - action.runs[0] >= 0.1
+
+
+def test_max_staleness_caps_min_interval(hass):
+    action = Action()
+    coalescer = UpdateCoalescer(hass, action, min_interval=60, max_staleness=0.05)
+
+    coalescer.async_request()
+    run(hass)
+    coalescer.async_request()
+    run(hass)
+
+    assert 0.04 <= action.runs[1] - action.runs[0] < 1
+
+
+def test_failed_update_doesnt_stop_the_next(hass):
+    calls = []
+
+    async def action():
+        calls.append(None)
+        if len(calls) == 1:
+            raise ValueError("Meter is gone")
+
+    coalescer = UpdateCoalescer(hass, action)
+    coalescer.async_request()
+    run(hass)
+    coalescer.async_request()
+    run(hass)
+
+    assert len(calls) == 2
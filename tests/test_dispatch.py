@@ -0,0 +1,74 @@
+"""Service calls through a real service registry."""
+import asyncio
+
+import pytest
+from homeassistant.const import SERVICE_TURN_OFF
+from homeassistant.core import HomeAssistant
+
+from custom_components.power_tariff.dispatch import ServiceDispatcher
+from custom_components.power_tariff.metrics import Metrics
+
+
+class Device:
+    action = None
+
+
+@pytest.fixture
+def hass():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield HomeAssistant(loop)
+    asyncio.set_event_loop(None)
+    loop.close()
+
+
+def execute(hass, plan, metrics):
+    dispatcher = ServiceDispatcher(hass)
+    return hass.loop.run_until_complete(dispatcher.async_execute(plan, metrics))
+
+
+def test_failed_call_is_counted(hass):
+    async def turn_off(call):
+        raise ValueError("Relay is stuck")
+
+    hass.services.async_register("homeassistant", SERVICE_TURN_OFF, turn_off)
+    metrics = Metrics()
+    device = Device()
+
+    done = execute(hass, [(device, SERVICE_TURN_OFF, "switch.heater")], metrics)
+
+    assert done == []
+    assert device.action is None
+    assert metrics.service_calls == 1
+    assert metrics.service_failures == 1
+
+
+def test_missing_service_is_counted(hass):
+    metrics = Metrics()
+
+    done = execute(hass, [(Device(), SERVICE_TURN_OFF, "switch.heater")], metrics)
+
+    assert done == []
+    assert metrics.service_not_found == 1
+    assert metrics.service_failures == 0
+
+
+def test_latency_covers_the_whole_call(hass):
+    calls = []
+
+    async def turn_off(call):
+        await asyncio.sleep(0.05)
+        calls.append(call.data["entity_id"])
+
+    hass.services.async_register("homeassistant", SERVICE_TURN_OFF, turn_off)
+    metrics = Metrics()
+    device = Device()
+
+    done = execute(hass, [(device, SERVICE_TURN_OFF, "switch.heater")], metrics)
+
+    assert done == [device]
+    assert device.action == SERVICE_TURN_OFF
+    assert calls == [["switch.heater"]]
+    assert metrics.service_failures == 0
+    assert metrics.service_latency.count == 1
+    assert metrics.service_latency.last >= 0.05
@@ -0,0 +1,117 @@
+"""EnergyWindow, fed with plain timestamps and watts."""
+import json
+
+import pytest
+
+from custom_components.power_tariff.energy import EnergyWindow
+
+HOUR = 1700002800  # Whole hour
+
+
+def feed(window, start, stop, step, power):
+    for timestamp in range(start, stop + 1, step):
+        window.add(timestamp, power)
+
+
+def test_split_at_hour_rollover():
+    window = EnergyWindow()
+    window.add(HOUR - 30, 1000)
+    window.add(HOUR + 30, 2000)
+
+    assert window.period_start == HOUR
+    # Power is 1500 W where the hour rolls over.
+    assert window.energy == pytest.approx((1500 + 2000) / 2 * 30 / 3600)
+    assert window.remaining == 3600 - 30
+
+
+def test_rollover_in_a_row():
+    window = EnergyWindow(period=60)
+    window.add(HOUR - 10, 600)
+    window.add(HOUR + 50, 600)
+    window.add(HOUR + 70, 600)
+
+    assert window.period_start == HOUR + 60
+    assert window.energy == pytest.approx(600 * 10 / 3600)
+
+
+def test_gap_resets():
+    window = EnergyWindow()
+    feed(window, HOUR, HOUR + 600, 10, 3000)
+    window.add(HOUR + 600 + 3601, 500)
+
+    assert window.energy == 0.0
+    assert window.period_start == HOUR + 3600
+    assert window.average_power == 500
+
+
+def test_projected_and_watts_to_shed():
+    window = EnergyWindow()
+    feed(window, HOUR, HOUR + 600, 10, 3600)
+
+    assert window.energy == pytest.approx(600)
+    assert window.average_power == pytest.approx(3600)
+    assert window.projected() == pytest.approx(3600)
+    # 600 Wh too much spread over the 3000 seconds left.
+    assert window.watts_to_shed(3000) == pytest.approx(720)
+    assert window.projected(-720) == pytest.approx(3000)
+    assert window.watts_to_shed(4000) == 0.0
+
+
+def test_watts_to_shed_at_the_end_of_the_period():
+    window = EnergyWindow()
+    feed(window, HOUR, HOUR + 3599, 1, 3600)
+
+    # Not divided by the one second that is left.
+    assert window.watts_to_shed(3000) == pytest.approx(
+        (window.projected() - 3000) * 3600 / window.slot_seconds
+    )
+
+
+def test_spike_is_averaged_out():
+    window = EnergyWindow()
+    feed(window, HOUR, HOUR + 590, 10, 1000)
+    window.add(HOUR + 600, 10000)
+
+    assert window.average_power < 1100
+
+
+@pytest.mark.parametrize("step", [1, 7, 120, 300])
+def test_average_power_with_sparse_samples(step):
+    window = EnergyWindow()
+    feed(window, HOUR, HOUR + 3000, step, 2000)
+
+    assert window.average_power == pytest.approx(2000)
+
+
+def test_average_power_after_a_long_gap():
+    window = EnergyWindow()
+    window.add(HOUR, 2000)
+    window.add(HOUR + 900, 2000)
+
+    assert window.average_power == pytest.approx(2000)
+
+
+def test_dump_load_round_trip():
+    window = EnergyWindow()
+    feed(window, HOUR, HOUR + 1200, 15, 2500)
+    feed(window, HOUR + 1210, HOUR + 1500, 10, 1500)
+
+    loaded = EnergyWindow()
+    loaded.load(json.loads(json.dumps(window.dump())))
+
+    assert loaded.dump() == window.dump()
+    assert loaded.projected() == window.projected()
+    for each in (window, loaded):
+        feed(each, HOUR + 1510, HOUR + 1800, 10, 4000)
+    assert loaded.projected() == window.projected()
+    assert loaded.average_power == window.average_power
+
+
+def test_load_ignores_other_ring_size():
+    window = EnergyWindow()
+    feed(window, HOUR, HOUR + 600, 10, 2500)
+
+    loaded = EnergyWindow(slots=30)
+    loaded.load(window.dump())
+
+    assert loaded.period_start is None
@@ -0,0 +1,77 @@
+"""The Holt forecast of the power usage."""
+import math
+
+import pytest
+
+from custom_components.power_tariff.forecast import LoadForecaster
+
+HOUR = 1700002800
+
+
+def test_first_sample_is_the_level():
+    forecaster = LoadForecaster()
+    assert forecaster.energy(3600) == 0.0
+
+    forecaster.add(HOUR, 1500)
+
+    assert forecaster.level == 1500
+    assert forecaster.trend == 0.0
+    assert forecaster.energy(3600) == pytest.approx(1500)
+
+
+def test_level_and_trend_update():
+    forecaster = LoadForecaster(level_smoothing=300, trend_smoothing=900)
+    forecaster.add(HOUR, 1000)
+    forecaster.add(HOUR + 300, 2000)
+
+    alpha = 1 - math.exp(-1)
+    beta = 1 - math.exp(-1 / 3)
+    level = 1000 + alpha * 1000
+    assert forecaster.level == pytest.approx(level)
+    assert forecaster.trend == pytest.approx(beta * (level - 1000) / 300)
+
+
+def test_old_and_repeated_samples_are_ignored():
+    forecaster = LoadForecaster()
+    forecaster.add(HOUR, 1000)
+    forecaster.add(HOUR, 5000)
+    forecaster.add(HOUR - 10, 5000)
+
+    assert forecaster.level == 1000
+
+
+def test_follows_a_ramp():
+    forecaster = LoadForecaster()
+    # 1 W more every second.
+    for second in range(0, 7200, 10):
+        forecaster.add(HOUR + second, 1000 + second)
+
+    assert forecaster.trend == pytest.approx(1, rel=0.05)
+    assert forecaster.power(60) == pytest.approx(forecaster.level + 60 * forecaster.trend)
+
+
+def test_trend_is_only_followed_to_the_horizon():
+    forecaster = LoadForecaster(trend_horizon=600)
+    forecaster.add(HOUR, 1000)
+    forecaster.level = 1000.0
+    forecaster.trend = 1.0
+
+    assert forecaster.power(300) == pytest.approx(1300)
+    assert forecaster.power(3600) == pytest.approx(1600)
+    # A ramp to 1600 W over 10 minutes, then 1600 W for the rest.
+    assert forecaster.energy(3600) == pytest.approx(1300 / 6 + 1600 * 50 / 60)
+
+
+def test_energy_only_counts_the_positive_part():
+    forecaster = LoadForecaster(trend_horizon=3600)
+    forecaster.add(HOUR, 1000)
+    forecaster.level = 600.0
+    forecaster.trend = -1.0
+
+    # Down to 0 W after 600 seconds and nothing after that.
+    assert forecaster.power(1200) == 0.0
+    assert forecaster.energy(3600) == pytest.approx(600 * 600 / 2 / 3600)
+
+    forecaster.level = -600.0
+    forecaster.trend = 1.0
+    assert forecaster.energy(1200) == pytest.approx(600 * 600 / 2 / 3600)
@@ -0,0 +1,175 @@
+"""Groups, turned off and on as one and in the order of depends_on."""
+import asyncio
+
+import pytest
+import voluptuous as vol
+from homeassistant.const import SERVICE_TURN_OFF, SERVICE_TURN_ON
+
+from custom_components.power_tariff import CONFIG_SCHEMA
+from custom_components.power_tariff.const import DOMAIN
+from custom_components.power_tariff.groups import GROUP_SCHEMA
+
+from .benchmarks.conftest import make_controller, raw_config
+from .benchmarks.fake_hass import FakeHass
+
+HOUR = 1700002800
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    asyncio.set_event_loop(None)
+    loop.close()
+
+
+def controller(devices, groups, run_hours=None, **settings):
+    hass = FakeHass()
+    raw = raw_config(devices, 1, groups=groups, **settings)
+    if run_hours:
+        for spec in raw["devices"]:
+            spec["run_hours"] = run_hours
+    pc = make_controller(hass, CONFIG_SCHEMA({DOMAIN: raw})[DOMAIN][0])
+    pc.check_tariff(HOUR)
+    return hass, pc
+
+
+HEATING = {
+    "name": "heating",
+    "devices": ["switch.device_0", "switch.device_1", "switch.device_2"],
+    "depends_on": {"switch.device_2": "switch.device_1"},
+}
+
+
+def test_plan_with_turn_offs_and_turn_ons(loop):
+    hass, pc = controller(4, [HEATING])
+    for entity_id in ("switch.device_1", "switch.device_2"):
+        hass.switches[entity_id].is_on = False
+    steps = [
+        (pc.devices[2], SERVICE_TURN_ON, "switch.device_2"),
+        (pc.devices[3], SERVICE_TURN_OFF, "switch.device_3"),
+        (pc.devices[1], SERVICE_TURN_ON, "switch.device_1"),
+    ]
+
+    stages = pc.groups.stages(steps)
+
+    assert [[step[2] for step in stage] for stage in stages] == [
+        ["switch.device_3"],
+        ["switch.device_1"],
+        ["switch.device_2"],
+    ]
+    loop.run_until_complete(pc.async_execute(steps))
+    assert hass.services.log == [
+        (SERVICE_TURN_OFF, ("switch.device_3",)),
+        (SERVICE_TURN_ON, ("switch.device_1",)),
+        (SERVICE_TURN_ON, ("switch.device_2",)),
+    ]
+
+
+def test_group_is_planned_as_one(loop):
+    hass, pc = controller(
+        3, [HEATING], run_hours=2, price_entity="sensor.prices", min_on_time=0
+    )
+    group = pc.groups.group_of[pc.devices[0]]
+
+    deferrable = pc._deferrable()
+
+    assert deferrable == [(group, 100.0 + 137.0 + 174.0, 2)]
+
+    # Planned off, the whole group goes off, dependent first.
+    pc.planner.wanted = lambda device, now: False if device is group else None
+    loop.run_until_complete(pc._run_plan(HOUR))
+    assert hass.services.log == [
+        (SERVICE_TURN_OFF, ("switch.device_2",)),
+        (SERVICE_TURN_OFF, ("switch.device_0", "switch.device_1")),
+    ]
+    assert all(pc.device_states[device].held for device in pc.devices)
+
+    # Planned on, the whole group goes on, in order.
+    hass.services.log.clear()
+    pc.planner.wanted = lambda device, now: True if device is group else None
+    loop.run_until_complete(pc._run_plan(HOUR + 3600))
+    assert hass.services.log == [
+        (SERVICE_TURN_ON, ("switch.device_0", "switch.device_1")),
+        (SERVICE_TURN_ON, ("switch.device_2",)),
+    ]
+    assert not any(pc.device_states[device].held for device in pc.devices)
+
+
+def stages(devices, depends_on):
+    return GROUP_SCHEMA(
+        {"name": "group", "devices": devices, "depends_on": depends_on}
+    ).stages
+
+
+def test_stages_of_a_chain():
+    assert stages(["c", "b", "a"], {"c": "b", "b": "a"}) == (("a",), ("b",), ("c",))
+
+
+def test_stages_of_a_diamond():
+    depends_on = {"b": "a", "c": "a", "d": ["b", "c"]}
+    assert stages(["a", "b", "c", "d"], depends_on) == (("a",), ("b", "c"), ("d",))
+
+
+def test_no_depends_on_is_one_stage():
+    assert stages(["a", "b"], {}) == (("a", "b"),)
+
+
+def test_cycle_is_rejected():
+    with pytest.raises(vol.Invalid, match="cycle"):
+        stages(["a", "b", "c"], {"a": "c", "b": "a", "c": "b"})
+
+
+def test_unknown_dependency_is_rejected():
+    with pytest.raises(vol.Invalid, match="not in group"):
+        stages(["a", "b"], {"b": "x"})
+
+
+PAIR = {
+    "name": "pair",
+    "devices": ["switch.device_0", "switch.device_1"],
+    "depends_on": {"switch.device_1": "switch.device_0"},
+}
+
+
+def over_limit(loop, pc):
+    # 50 W over, and over_limit_acceptance_seconds is 0.
+    loop.run_until_complete(pc.update(3050.0, HOUR))
+
+
+def test_group_is_shed_as_one_in_reverse_order(loop):
+    hass, pc = controller(4, [PAIR])
+
+    over_limit(loop, pc)
+
+    assert hass.services.log == [
+        (SERVICE_TURN_OFF, ("switch.device_1",)),
+        (SERVICE_TURN_OFF, ("switch.device_0",)),
+    ]
+    assert pc.devices[0] in pc.shed and pc.devices[1] in pc.shed
+
+
+def test_group_is_skipped_if_all_of_it_cant_be_shed(loop):
+    hass, pc = controller(4, [PAIR])
+    pc.devices[0].turn_off()
+
+    over_limit(loop, pc)
+
+    # The next device in priority order goes instead.
+    assert hass.services.log == [(SERVICE_TURN_OFF, ("switch.device_2",))]
+    assert hass.switches["switch.device_1"].is_on
+
+
+def test_group_is_restored_in_order(loop):
+    hass, pc = controller(4, [PAIR], min_off_time=0)
+    over_limit(loop, pc)
+    hass.services.log.clear()
+
+    loop.run_until_complete(pc.update(500.0, HOUR + 60))
+
+    assert hass.services.log == [
+        (SERVICE_TURN_ON, ("switch.device_0",)),
+        (SERVICE_TURN_ON, ("switch.device_1",)),
+    ]
+    assert not pc.shed
@@ -0,0 +1,120 @@
+"""The shed/restore cycle of a device, and min_off_time/min_on_time."""
+import asyncio
+
+import pytest
+from homeassistant.const import SERVICE_TURN_OFF, SERVICE_TURN_ON
+
+from custom_components.power_tariff import CONFIG_SCHEMA
+from custom_components.power_tariff.const import DOMAIN
+from custom_components.power_tariff.hysteresis import (STATE_COOLDOWN,
+                                                       STATE_HELD, STATE_ON,
+                                                       STATE_RESTORING,
+                                                       STATE_SHED, DeviceState)
+
+from .benchmarks.conftest import make_controller, raw_config
+from .benchmarks.fake_hass import FakeHass
+
+HOUR = 1700002800
+MIN_OFF = 300
+MIN_ON = 600
+
+
+def state_at(state, now):
+    return state.state(now, MIN_OFF, MIN_ON)
+
+
+def test_shed_and_restore():
+    state = DeviceState()
+    assert state.can_shed(HOUR, MIN_OFF, MIN_ON)
+
+    state.shed(HOUR)
+    assert state_at(state, HOUR + MIN_OFF - 1) == STATE_SHED
+    assert not state.can_restore(HOUR + MIN_OFF - 1, MIN_OFF, MIN_ON)
+    assert state_at(state, HOUR + MIN_OFF) == STATE_COOLDOWN
+    # Cooldown lasts until there is room, not for a time.
+    assert state_at(state, HOUR + 10 * MIN_OFF) == STATE_COOLDOWN
+    assert state.can_restore(HOUR + 10 * MIN_OFF, MIN_OFF, MIN_ON)
+
+    restored = HOUR + 10 * MIN_OFF
+    state.restore(restored)
+    assert state_at(state, restored + MIN_ON - 1) == STATE_RESTORING
+    assert not state.can_shed(restored + MIN_ON - 1, MIN_OFF, MIN_ON)
+    assert state_at(state, restored + MIN_ON) == STATE_ON
+    assert (state.sheds, state.restores) == (1, 1)
+
+
+def test_hold_release_and_reset():
+    state = DeviceState()
+    state.hold(HOUR)
+    assert state.held
+    # Held until the plan lets go, however long it takes.
+    assert state_at(state, HOUR + 10 * MIN_OFF) == STATE_HELD
+    assert not state.can_restore(HOUR + 10 * MIN_OFF, MIN_OFF, MIN_ON)
+
+    state.release()
+    assert state_at(state, HOUR) == STATE_COOLDOWN
+
+    state.hold(HOUR, called=False)
+    state.reset()
+    assert state_at(state, HOUR) == STATE_ON
+    assert state.sheds == 1
+    assert state.service_calls_last_hour(HOUR + 3600) == 1
+
+
+def test_service_calls_last_hour():
+    state = DeviceState()
+    state.shed(HOUR + 10)
+    state.restore(HOUR + 1000)
+    assert state.service_calls_last_hour(HOUR + 1000) == 0
+    assert state.service_calls_last_hour(HOUR + 3600) == 2
+
+    state.shed(HOUR + 3700)
+    assert state.service_calls_last_hour(HOUR + 3700) == 2
+    assert state.service_calls_last_hour(HOUR + 7200) == 1
+    assert state.service_calls_last_hour(HOUR + 3 * 3600) == 0
+
+
+def test_dump_load_round_trip():
+    state = DeviceState()
+    state.shed(HOUR)
+
+    loaded = DeviceState()
+    loaded.load(state.dump())
+
+    assert loaded.dump() == state.dump()
+    assert state_at(loaded, HOUR + MIN_OFF) == STATE_COOLDOWN
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    asyncio.set_event_loop(None)
+    loop.close()
+
+
+def test_controller_keeps_min_off_and_min_on_time(loop):
+    hass = FakeHass()
+    raw = raw_config(2, 1, min_off_time=MIN_OFF, min_on_time=MIN_ON)
+    pc = make_controller(hass, CONFIG_SCHEMA({DOMAIN: raw})[DOMAIN][0])
+    pc.check_tariff(HOUR)
+    log = hass.services.log
+
+    def update(power_usage, timestamp):
+        log.clear()
+        loop.run_until_complete(pc.update(power_usage, timestamp))
+        return log[:]
+
+    # 50 W over, the lowest priority device goes.
+    assert update(3050.0, HOUR) == [(SERVICE_TURN_OFF, ("switch.device_0",))]
+    # Room for it again, but not before min_off_time.
+    assert update(500.0, HOUR + MIN_OFF - 1) == []
+    assert update(500.0, HOUR + MIN_OFF) == [(SERVICE_TURN_ON, ("switch.device_0",))]
+    # Within min_on_time the next one has to go instead.
+    assert update(3050.0, HOUR + MIN_OFF + 1) == [
+        (SERVICE_TURN_OFF, ("switch.device_1",))
+    ]
+    assert pc.device_states[pc.devices[0]].can_shed(
+        HOUR + MIN_OFF + MIN_ON, MIN_OFF, MIN_ON
+    )
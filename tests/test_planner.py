@@ -0,0 +1,43 @@
+"""Planning the deferrable devices from the price sensor."""
+import asyncio
+
+import homeassistant.util.dt as dt_util
+import pytest
+
+from custom_components.power_tariff import CONFIG_SCHEMA
+from custom_components.power_tariff.const import DOMAIN
+from custom_components.power_tariff.schedule import start_of_local_day
+
+from .benchmarks.conftest import make_controller, raw_config
+from .benchmarks.fake_hass import FakeHass
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    asyncio.set_event_loop(None)
+    loop.close()
+
+
+def test_update_prices_plans_the_cheapest_hours(loop):
+    hass = FakeHass()
+    raw = raw_config(1, 1, price_entity="sensor.prices")
+    raw["devices"][0]["run_hours"] = 2
+    pc = make_controller(hass, CONFIG_SCHEMA({DOMAIN: raw})[DOMAIN][0])
+    prices = [1.0] * 24
+    prices[3] = 0.1
+    prices[17] = 0.2
+    hass.states.async_set("sensor.prices", "1.0", {"today": prices})
+
+    pc.async_update_prices()
+
+    day_start = start_of_local_day(dt_util.now().date()).timestamp()
+    device = pc.devices[0]
+    planned = [
+        hour
+        for hour in range(24)
+        if pc.planner.wanted(device, day_start + hour * 3600 + 1)
+    ]
+    assert planned == [3, 17]
@@ -0,0 +1,80 @@
+"""The tariff schedule around DST changes."""
+import datetime as dt
+
+import homeassistant.util.dt as dt_util
+import pytest
+
+from custom_components.power_tariff import CONFIG_SCHEMA
+from custom_components.power_tariff.const import DOMAIN
+from custom_components.power_tariff.schedule import TariffSchedule, pick_tariff
+
+
+@pytest.fixture
+def oslo():
+    default = dt_util.DEFAULT_TIME_ZONE
+    dt_util.set_default_time_zone(dt_util.get_time_zone("Europe/Oslo"))
+    yield
+    dt_util.set_default_time_zone(default)
+
+
+def local(*args):
+    """Timestamp of a local wall clock time."""
+    return dt_util.DEFAULT_TIME_ZONE.localize(dt.datetime(*args)).timestamp()
+
+
+def make_tariffs():
+    conf = {
+        "monitor_entity": "sensor.power",
+        "tariffs": [
+            {
+                "name": "day",
+                "limit_kwh": 3000,
+                "restrictions": {"time": {"start": "06:00:00", "end": "22:00:00"}},
+            },
+            {"name": "night", "limit_kwh": 5000},
+        ],
+    }
+    return CONFIG_SCHEMA({DOMAIN: conf})[DOMAIN][0]["tariffs"]
+
+
+@pytest.mark.parametrize("day", [dt.date(2023, 3, 26), dt.date(2023, 10, 29)])
+def test_boundaries_on_dst_change(oslo, day):
+    schedule = TariffSchedule(make_tariffs())
+    date = (day.year, day.month, day.day)
+
+    assert schedule.lookup(local(*date, 5, 59, 59)).name == "night"
+    assert schedule.lookup(local(*date, 6)).name == "day"
+    assert schedule.next_boundary == local(*date, 22)
+    assert schedule.lookup(local(*date, 21, 59, 59)).name == "day"
+    assert schedule.lookup(local(*date, 22)).name == "night"
+
+
+def test_lookup_matches_valid(oslo):
+    tariffs = make_tariffs()
+    schedule = TariffSchedule(tariffs)
+    start = local(2023, 3, 25)
+    for timestamp in range(int(start), int(start) + 3 * 86400, 599):
+        now = dt_util.as_local(dt_util.utc_from_timestamp(timestamp))
+        assert schedule.lookup(timestamp) is pick_tariff(tariffs, now)
+
+
+def test_no_gap_before_midnight(oslo):
+    conf = {
+        "monitor_entity": "sensor.power",
+        "tariffs": [
+            {"name": "weekend", "restrictions": {"weekday": ["sat", "sun"]}},
+            {
+                "name": "weekday",
+                "restrictions": {"weekday": ["mon", "tue", "wed", "thu", "fri"]},
+            },
+        ],
+    }
+    schedule = TariffSchedule(CONFIG_SCHEMA({DOMAIN: conf})[DOMAIN][0]["tariffs"])
+
+    # 2023-03-20 is a monday.
+    for day in range(20, 27):
+        assert schedule.lookup(local(2023, 3, day, 23, 59, 59, 500000)) is not None
+    assert schedule.lookup(local(2023, 3, 24, 23, 59, 59)).name == "weekday"
+    assert schedule.lookup(local(2023, 3, 25)).name == "weekend"
+    # Nothing changes between friday night and monday morning.
+    assert schedule.next_boundary == local(2023, 3, 27)
@@ -0,0 +1,42 @@
+"""The diagnostic sensors."""
+import asyncio
+
+import pytest
+
+from custom_components.power_tariff import sensor
+from custom_components.power_tariff.const import DOMAIN
+
+from .benchmarks.conftest import make_config, make_controller
+from .benchmarks.fake_hass import FakeHass
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    asyncio.set_event_loop(None)
+    loop.close()
+
+
+def setup_sensors(loop, **settings):
+    hass = FakeHass()
+    hass.data[DOMAIN] = {0: make_controller(hass, make_config(1, 1, **settings))}
+    sensors = []
+
+    def add_entities(entities, update):
+        sensors.extend(entities)
+
+    loop.run_until_complete(
+        sensor.async_setup_platform(hass, {}, add_entities, {"controller": 0})
+    )
+    return {s.name: s for s in sensors}
+
+
+@pytest.mark.parametrize(
+    "limit_mode, unit", [("power", "W"), ("energy", "Wh"), ("forecast", "Wh")]
+)
+def test_headroom_unit_follows_limit_mode(loop, limit_mode, unit):
+    sensors = setup_sensors(loop, limit_mode=limit_mode)
+
+    assert sensors[f"{DOMAIN}_headroom"].unit_of_measurement == unit
@@ -0,0 +1,106 @@
+"""Sharing the headroom between the devices with a setpoint."""
+import asyncio
+from collections import namedtuple
+
+import pytest
+
+from custom_components.power_tariff import CONFIG_SCHEMA
+from custom_components.power_tariff.const import DOMAIN
+from custom_components.power_tariff.throttle import (ThrottleSpec, Throttler,
+                                                     quantize, water_fill)
+
+from .benchmarks.conftest import make_controller, raw_config
+from .benchmarks.fake_hass import FakeHass
+
+HOUR = 1700002800
+
+Device = namedtuple("Device", ["throttle", "priority"])
+
+
+def charger(priority=10, step=1.0, deadband=2.0):
+    # Amps on one phase.
+    return Device(ThrottleSpec("number.charger", 6, 16, step, 230, deadband), priority)
+
+
+def test_water_fill_by_priority():
+    items = [(0, 1000, 1), (0, 1000, 3)]
+    assert water_fill(items, 800) == pytest.approx([200, 600])
+
+
+def test_water_fill_keeps_low_and_high():
+    items = [(300, 1000, 1), (0, 1000, 1), (0, 150, 1)]
+    filled = water_fill(items, 900)
+    assert filled == pytest.approx([375, 375, 150])
+    assert sum(filled) == pytest.approx(900)
+
+
+@pytest.mark.parametrize("budget, expected", [(100, [300, 0]), (5000, [1000, 1000])])
+def test_water_fill_out_of_range(budget, expected):
+    assert water_fill([(300, 1000, 1), (0, 1000, 1)], budget) == expected
+
+
+@pytest.mark.parametrize(
+    "value, step, expected",
+    [
+        (9.7, 1.0, 9),
+        (6.9999999999, 1.0, 7),
+        (7.74, 0.5, 7.5),
+        (2, 1.0, 6),
+        (20, 1.0, 16),
+    ],
+)
+def test_quantize(value, step, expected):
+    assert quantize(charger(step=step).throttle, value) == expected
+
+
+def test_plan_moves_by_priority():
+    low, high = charger(priority=1), charger(priority=3)
+    current = {low: 16, high: 16}.get
+
+    changes = Throttler().plan([low, high], -8 * 230, current)
+
+    # The high priority one keeps its max as long as the low one can give.
+    assert changes == [(low, 8, -8 * 230)]
+
+
+def test_plan_deadband():
+    device = charger(deadband=2)
+    throttler = Throttler()
+
+    # One amp is less then the deadband.
+    assert throttler.plan([device], 230, lambda _: 10) == []
+    assert throttler.plan([device], 2 * 230, lambda _: 10) == [(device, 12, 460)]
+    # Going to max or min is always sent.
+    assert throttler.plan([device], 230, lambda _: 15) == [(device, 16, 230)]
+    assert throttler.plan([device], -230, lambda _: 7) == [(device, 6, -230)]
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    asyncio.set_event_loop(None)
+    loop.close()
+
+
+def test_restore_margin_in_watts(loop):
+    raw = raw_config(1, 1, limit_mode="energy", restore_margin=500)
+    raw["devices"][0]["throttle"] = {
+        "entity": "number.charger",
+        "min": 0,
+        "max": 40,
+        "watts_per_unit": 100,
+    }
+    hass = FakeHass()
+    pc = make_controller(hass, CONFIG_SCHEMA({DOMAIN: raw})[DOMAIN][0])
+    pc.check_tariff(HOUR)
+    hass.states.async_set("number.charger", "0")
+    # 1000 Wh used in the first half hour, 2000 Wh projected of 3000.
+    for timestamp in range(HOUR, HOUR + 1801, 10):
+        pc.energy.add(timestamp, 2000.0)
+
+    loop.run_until_complete(pc._throttle(2000.0))
+
+    # 1000 Wh left in half an hour is 2000 W, the 500 Wh margin is 1000 W.
+    assert pc.throttler.setpoints[pc.devices[0]] == 10
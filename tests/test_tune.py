@@ -0,0 +1,57 @@
+"""The settings sweep against the controllers own over limit check."""
+from types import SimpleNamespace
+
+import pytest
+
+from custom_components.power_tariff.decision import should_reduce_power
+
+np = pytest.importorskip("numpy")
+tune = pytest.importorskip("custom_components.power_tariff.tune")
+
+HOUR = 1700002800
+LIMIT = 3000
+
+
+def replay(times, power, seconds):
+    """How many times the controller would shed, without shedding anything."""
+    tariff = SimpleNamespace(over_limit_acceptance_seconds=seconds)
+    first_over_limit = None
+    events = 0
+    for timestamp, usage in zip(times, power):
+        snapshot = SimpleNamespace(
+            tariff=tariff,
+            timestamp=timestamp,
+            usage=usage,
+            limit=LIMIT,
+            phase_excess=(),
+            first_over_limit=first_over_limit,
+        )
+        reduce_power, first_over_limit = should_reduce_power(snapshot)
+        events += reduce_power
+    return events
+
+
+def test_events_match_the_controller():
+    rng = np.random.default_rng(1)
+    times = HOUR + np.cumsum(rng.integers(1, 15, 5000)).astype(float)
+    power = 2800 + 600 * np.sin(times / 400) + rng.normal(0, 150, times.size)
+    seconds = [0.0, 1.0, 10.0, 30.0, 60.0, 300.0]
+
+    rows = tune.sweep(times, power, [LIMIT], [0.0], seconds)
+
+    assert [row["events"] for row in rows] == [
+        replay(times, power, limit_seconds) for limit_seconds in seconds
+    ]
+
+
+def test_shed_after_more_then_the_acceptance():
+    # 1 s readings over the limit for a minute.
+    times = HOUR + np.arange(61, dtype=float)
+    power = np.full(times.size, LIMIT + 1000.0)
+
+    (row,) = tune.sweep(times, power, [LIMIT], [0.0], [30.0])
+
+    # Shed at 31 s, start over at 32 s and it isnt more then 30 s after that.
+    assert row["events"] == 1
+    # From 31 s until the last reading at 60 s.
+    assert row["curtailed_kwh"] == pytest.approx(1000 * 29 / 3600 / 1000)